@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -63,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -105,6 +107,63 @@ DATABASES = {
     }
 }
 
+# Connection reuse
+# DB_POOL=true uses psycopg 3's pool (works under both WSGI and ASGI); connections are
+# checked out per request and returned on close, so CONN_MAX_AGE has to stay 0.
+# Without it, connections persist for CONN_MAX_AGE seconds and are health-checked on reuse.
+DB_POOL = os.getenv('DB_POOL', 'false').lower() in ('1', 'true', 'yes')
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            # connections above min_size are the overflow, closed again after max_idle seconds
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            'max_waiting': int(os.getenv('DB_POOL_MAX_WAITING', 0)),
+            'name': 'payprotect',
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replica
+# Safe requests to views with replica_reads = True read from this alias when it is configured.
+# A client that wrote is pinned to the primary for REPLICA_PIN_SECONDS (via a cookie) so it
+# always reads its own writes.
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+REPLICA_PIN_COOKIE = 'pp_primary_until'
+
+if os.getenv('POSTGRES_REPLICA_HOST'):
+    DATABASES[REPLICA_DATABASE] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('POSTGRES_REPLICA_HOST'),
+        'PORT': os.getenv('POSTGRES_REPLICA_PORT', os.getenv('POSTGRES_PORT')),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# 'default' is the shared L2 holding versions, invalidations and revocations, so every process
+# must see the same one (file or database backend works without extra services).
+# 'local' is a per-process L1 for version-keyed payloads.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'payprotect-cache')),
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'payprotect-local',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -142,6 +201,15 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# How /media/ responses are delivered: 'django' streams them (with ETag and Range support),
+# 'accel' hands off to nginx through X-Accel-Redirect, 'sendfile' to Apache/lighttpd via X-Sendfile
+MEDIA_SERVE_MODE = os.getenv('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# Uploaded photos are staged here and written to MEDIA_ROOT by a pool of ingestion workers
+IMAGE_INGEST_WORKERS = int(os.getenv('IMAGE_INGEST_WORKERS', 4))
+IMAGE_INGEST_STAGING_DIR = os.getenv('IMAGE_INGEST_STAGING_DIR') or None
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -174,11 +242,21 @@ CORS_ALLOW_METHODS = (
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # orjson when installed, DRF's stdlib encoder otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny"
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.StatelessJWTAuthentication',
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
         'drf_social_oauth2.authentication.SocialAuthentication',
     ),
@@ -192,12 +270,23 @@ SIMPLE_JWT = {
     'ALGORITHM': 'HS256',
     'VERIFYING_KEY': None,
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_USER_CLASS': 'core.authentication.ClaimsUser',
 
     "TOKEN_OBTAIN_SERIALIZER": "core.serializers.CustomTokenObtainPairSerializer",
     "TOKEN_REFRESH_SERIALIZER": "core.serializers.CustomTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "core.serializers.CustomTokenVerifySerializer",
 }
 
+# rows serialized per chunk when a list is streamed (?stream=true)
+JSON_STREAM_CHUNK_SIZE = int(os.getenv('JSON_STREAM_CHUNK_SIZE', 500))
+
+# rows fetched and written per chunk by the CSV/NDJSON exports
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# last_login updates are buffered in memory and flushed in bulk every few seconds or once this many are pending
+LOGIN_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('LOGIN_ACTIVITY_FLUSH_INTERVAL', 5))
+LOGIN_ACTIVITY_MAX_PENDING = int(os.getenv('LOGIN_ACTIVITY_MAX_PENDING', 500))
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'PayProtect API',
     'DESCRIPTION': 'Protecting buyer and seller transaction ensuring each party get value from one another',
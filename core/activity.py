@@ -0,0 +1,75 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from core.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class LoginActivityRecorder:
+    """Buffers last_login timestamps and writes them in coalesced bulk updates."""
+
+    def __init__(self, flush_interval, max_pending):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.timer = None
+
+    def record(self, user_id, timestamp=None):
+        with self.lock:
+            # repeated logins by the same user collapse into the latest timestamp
+            self.pending[user_id] = timestamp or now()
+            if len(self.pending) >= self.max_pending:
+                self._schedule(0)
+            elif self.timer is None:
+                self._schedule(self.flush_interval)
+
+    def _schedule(self, delay):
+        if self.timer is not None:
+            self.timer.cancel()
+        # the write never happens on the request thread
+        self.timer = threading.Timer(delay, self._flush_in_background)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            if not pending:
+                return 0
+
+            users = [User(pk=user_id, last_login=timestamp) for user_id, timestamp in pending.items()]
+            try:
+                User.objects.bulk_update(users, ['last_login'], batch_size=500)
+            except Exception:
+                logger.exception(f"Failed to write last_login for {len(users)} users")
+                with self.lock:
+                    # put them back unless a newer login was recorded meanwhile
+                    for user_id, timestamp in pending.items():
+                        self.pending.setdefault(user_id, timestamp)
+                return 0
+            return len(users)
+
+
+login_activity = LoginActivityRecorder(
+    flush_interval=settings.LOGIN_ACTIVITY_FLUSH_INTERVAL,
+    max_pending=settings.LOGIN_ACTIVITY_MAX_PENDING,
+)
+atexit.register(login_activity.flush)
@@ -1,7 +1,10 @@
 from django.contrib import admin
 
 from core.models import Bank, PayoutAccount, Product, ProductImage, ContractQuestion, Agreement, DisputeReason, Dispute, \
-    DisputeImage, ProtectionFee, User, FAQs
+    DisputeImage, ProtectionFee, User, FAQs, MediaBlob, LedgerEntry, Transaction
+
+from core.exports import export_action, DISPUTE_EXPORT_COLUMNS, PAYOUT_ACCOUNT_EXPORT_COLUMNS, PRODUCT_EXPORT_COLUMNS
+from core.ledger import with_ledger_balance
 
 
 @admin.register(User)
@@ -19,11 +22,30 @@ class BankAdmin(admin.ModelAdmin):
 @admin.register(PayoutAccount)
 class PayoutAccountAdmin(admin.ModelAdmin):
     list_display = ('id', 'bank', 'account_number', 'account_name', 'balance', 'user', 'created_at')
+    readonly_fields = ('balance',)
+    actions = [
+        export_action(PAYOUT_ACCOUNT_EXPORT_COLUMNS, 'csv', with_ledger_balance),
+        export_action(PAYOUT_ACCOUNT_EXPORT_COLUMNS, 'ndjson', with_ledger_balance),
+    ]
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'account', 'amount', 'description', 'idempotency_key', 'rolled_up', 'created_at')
+    list_filter = ('rolled_up',)
+
+    # the ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'description', 'amount', 'fee', 'user', 'receiver', 'created_at')
+    actions = [export_action(PRODUCT_EXPORT_COLUMNS, 'csv'), export_action(PRODUCT_EXPORT_COLUMNS, 'ndjson')]
 
 
 @admin.register(ProductImage)
@@ -49,6 +71,7 @@ class DisputeReasonAdmin(admin.ModelAdmin):
 @admin.register(Dispute)
 class DisputeAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'product', 'reason', 'description', 'created_at')
+    actions = [export_action(DISPUTE_EXPORT_COLUMNS, 'csv'), export_action(DISPUTE_EXPORT_COLUMNS, 'ndjson')]
 
 
 @admin.register(DisputeImage)
@@ -63,4 +86,17 @@ class ProtectionFeeAdmin(admin.ModelAdmin):
 
 @admin.register(FAQs)
 class FAQsAdmin(admin.ModelAdmin):
-    list_display = ('id', 'question', 'answer', 'created_at')
\ No newline at end of file
+    list_display = ('id', 'question', 'answer', 'created_at')
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'size', 'refcount', 'created_at')
+
+
+@admin.register(Transaction)
+class TransactionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product', 'buyer', 'seller', 'amount', 'fee', 'state', 'version', 'created_at')
+    list_filter = ('state',)
+    # state only moves through the escrow transitions
+    readonly_fields = ('state', 'version')
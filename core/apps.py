@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        import core.signals  # noqa: F401
+        from core.countries import country_payload
+
+        # build the country list for the default language up front
+        country_payload(settings.LANGUAGE_CODE)
@@ -0,0 +1,164 @@
+import base64
+import binascii
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from core.authentication import StatelessJWTAuthentication, ais_token_revoked
+from core.cache import aget_product_review
+from core.models import Product
+from core.renderers import ORJSONRenderer
+from core.search import SEARCH_PARAM
+from core.serializers import ProductReviewSerializer
+from core.views import ProductViewSet, DisputeViewSet
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+renderer = ORJSONRenderer()
+authenticator = StatelessJWTAuthentication()
+
+# a keyset page can only follow (-created_at, -id), not a relevance or ?ordering= sort, so these
+# are refused instead of silently ignored
+UNSUPPORTED_LIST_PARAMS = (SEARCH_PARAM, drf_settings.ORDERING_PARAM)
+
+
+def render(data, status=200):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+async def authenticate(request):
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return None
+    # signature and expiry checks are pure CPU and run on the event loop
+    token = authenticator.get_validated_token(raw_token)
+    if 'groups' not in token:
+        # tokens issued before the claims were embedded need the user row, looked up exactly
+        # as the DRF views do
+        return await sync_to_async(authenticator.get_user)(token)
+    # answered from process memory except about once per REVOCATION_LOCAL_TIMEOUT per user
+    if await ais_token_revoked(token):
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+    return api_settings.TOKEN_USER_CLASS(token)
+
+
+def async_api_view(view):
+    """Authenticates like the DRF views (401 without a valid JWT) and sets request.user."""
+
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await authenticate(request)
+        except (InvalidToken, AuthenticationFailed, TokenError) as e:
+            detail = getattr(e, 'detail', str(e))
+            return render(detail if isinstance(detail, dict) else {'detail': str(detail)}, status=401)
+        if user is None:
+            return render({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+
+    return require_safe(wrapper)
+
+
+def encode_cursor(obj):
+    position = f'{obj.created_at.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError(cursor)
+        return created_at, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(cursor)
+
+
+def viewset_for(viewset_class, request, action):
+    """
+    The DRF viewset set up for ``request``, so these views use its queryset, filter backends and
+    ?fields=/?expand= serializer and the two paths cannot drift apart. Nothing here queries.
+    """
+    drf_request = Request(request)
+    drf_request.user = request.user
+    return viewset_class(request=drf_request, action=action, format_kwarg=None, args=(), kwargs={})
+
+
+async def list_page(request, viewset_class):
+    unsupported = [param for param in UNSUPPORTED_LIST_PARAMS if param in request.GET]
+    if unsupported:
+        return render({"success": False, 'error': f"Not supported on this endpoint: {', '.join(unsupported)}"},
+                      status=400)
+    view = viewset_for(viewset_class, request, 'list')
+    try:
+        queryset = view.filter_queryset(view.get_queryset())
+    except ValidationError as e:
+        return render(e.detail, status=400)
+    return await keyset_page(request, queryset, lambda page: view.get_serializer(page, many=True).data)
+
+
+async def keyset_page(request, queryset, serialize):
+    # same (-created_at, -id) order and index as the sync cursor pagination
+    try:
+        page_size = max(min(int(request.GET.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE), 1)
+        cursor = request.GET.get('cursor')
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    except ValueError:
+        return render({"success": False, 'error': 'Invalid cursor or page size'}, status=400)
+
+    queryset = queryset.order_by('-created_at', '-id')[:page_size + 1]
+    rows = [row async for row in queryset.aiterator(chunk_size=MAX_PAGE_SIZE + 1)]
+    page, has_more = rows[:page_size], len(rows) > page_size
+
+    next_url = None
+    if has_more and page:
+        query = request.GET.copy()
+        query['cursor'] = encode_cursor(page[-1])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    return render({'next': next_url, 'previous': None, 'results': serialize(page)})
+
+
+@async_api_view
+async def product_list(request):
+    return await list_page(request, ProductViewSet)
+
+
+@async_api_view
+async def product_detail(request, pk):
+    view = viewset_for(ProductViewSet, request, 'retrieve')
+    try:
+        product = await view.get_queryset().aget(pk=pk)
+    except Product.DoesNotExist:
+        return render({'detail': 'No Product matches the given query.'}, status=404)
+    return render(view.get_serializer(product).data)
+
+
+@async_api_view
+async def product_review(request, pk):
+    def build_review():
+        queryset = Product.objects.prefetch_related('productimage_set', 'agreement_set')
+        return ProductReviewSerializer(queryset.get(pk=pk)).data
+
+    try:
+        return render(await aget_product_review(pk, build_review))
+    except Product.DoesNotExist:
+        return render({'detail': 'No Product matches the given query.'}, status=404)
+
+
+@async_api_view
+async def dispute_list(request):
+    return await list_page(request, DisputeViewSet)
@@ -0,0 +1,91 @@
+import time
+
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+REVOCATION_KEY = 'jwt-revoked:{}'
+# how long a process may answer revocation checks from its own memory; a revocation made
+# elsewhere reaches it within this window
+REVOCATION_LOCAL_TIMEOUT = 5
+
+
+def revoke_user_tokens(user_id):
+    from core.models import TokenRevocation
+
+    revoked_at = time.time()
+    TokenRevocation.objects.update_or_create(user_id=user_id, defaults={'revoked_at': revoked_at})
+    caches['local'].set(REVOCATION_KEY.format(user_id), revoked_at, REVOCATION_LOCAL_TIMEOUT)
+
+
+def revocations(user_id):
+    from core.models import TokenRevocation
+
+    # always the primary: a lagging replica would hide a revocation that just happened
+    return TokenRevocation.objects.using('default').filter(user_id=user_id).values_list('revoked_at', flat=True)
+
+
+def issued_before(token, revoked_at):
+    # iat only has second precision, auth_time tells a login apart from a revocation in the same second
+    return revoked_at is not None and token.get('auth_time', token.get('iat', 0)) < revoked_at
+
+
+def is_token_revoked(token):
+    user_id = token[api_settings.USER_ID_CLAIM]
+    key = REVOCATION_KEY.format(user_id)
+    # L1 is this process' memory (0 = not revoked), so a user's revocation row is read at most
+    # once per REVOCATION_LOCAL_TIMEOUT per process
+    local = caches['local']
+    revoked_at = local.get(key)
+    if revoked_at is None:
+        revoked_at = revocations(user_id).first() or 0
+        local.set(key, revoked_at, REVOCATION_LOCAL_TIMEOUT)
+    return issued_before(token, revoked_at or None)
+
+
+async def ais_token_revoked(token):
+    user_id = token[api_settings.USER_ID_CLAIM]
+    key = REVOCATION_KEY.format(user_id)
+    # locmem is plain process memory, read without leaving the event loop
+    local = caches['local']
+    revoked_at = local.get(key)
+    if revoked_at is None:
+        revoked_at = await revocations(user_id).afirst() or 0
+        local.set(key, revoked_at, REVOCATION_LOCAL_TIMEOUT)
+    return issued_before(token, revoked_at or None)
+
+
+def add_user_claims(token, user):
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    token['groups'] = list(user.groups.values_list('name', flat=True))
+    return token
+
+
+def is_admin(user):
+    group_names = getattr(user, 'group_names', None)
+    if group_names is not None:
+        return 'admin' in group_names
+    return user.groups.filter(name='admin').exists()
+
+
+class ClaimsUser(TokenUser):
+    @cached_property
+    def group_names(self):
+        return frozenset(self.token.get('groups', []))
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    fallback = JWTAuthentication()
+
+    def get_user(self, validated_token):
+        # tokens issued before the claims were embedded still need the database
+        if 'groups' not in validated_token:
+            return self.fallback.get_user(validated_token)
+        if is_token_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        # builds a ClaimsUser (TOKEN_USER_CLASS) from the claims without touching the database
+        return super().get_user(validated_token)
@@ -0,0 +1,148 @@
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+from core.db_router import primary_reads
+from core.models import ContractQuestion
+
+REVIEW_CACHE_TIMEOUT = 60 * 60
+QUESTIONS_CACHE_TIMEOUT = 60 * 60 * 24
+LIST_CACHE_TIMEOUT = 60 * 60 * 24
+REVIEW_CACHE_HITS = 'review-cache:hits'
+REVIEW_CACHE_MISSES = 'review-cache:misses'
+
+
+def model_version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def get_version(key, timeout=None):
+    # versions live in the shared cache so a write in one process invalidates every process
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout)
+        version = cache.get(key)
+    return version
+
+
+def get_model_version(model):
+    return get_version(model_version_key(model))
+
+
+def bump_model_version(model):
+    # a fresh random version rather than incr(): the file and database backends do not
+    # increment atomically, and two racing bumps must never land on the same value
+    version = uuid.uuid4().hex
+    cache.set(model_version_key(model), version, None)
+    return version
+
+
+def get_cached(key, build, timeout):
+    # L1 is this process' memory, L2 the shared backend; keys embed a version so L1 never goes stale
+    local = caches['local']
+    value = local.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is None:
+            # fills usually follow a version bump: a lagging replica would store the old rows
+            # under the new key, where they would outlive the invalidation
+            with primary_reads():
+                value = build()
+            cache.set(key, value, timeout)
+        local.set(key, value, timeout)
+    return value
+
+
+def _count(key):
+    # per-process counters: a shared-cache write on every hit would cost more than the hit saves
+    local = caches['local']
+    local.add(key, 0, None)
+    try:
+        local.incr(key)
+    except ValueError:
+        pass
+
+
+def get_contract_questions(build):
+    key = f'contract-questions:{get_model_version(ContractQuestion)}'
+    return get_cached(key, lambda: list(build()), QUESTIONS_CACHE_TIMEOUT)
+
+
+def product_review_version_key(product_id):
+    return f'version:product-review:{product_id}'
+
+
+def product_review_key(product_id, product_version, question_version):
+    # the payload embeds the question set, so it is only valid for the question version it was built with
+    return f'product-review:{product_id}:{product_version}:{question_version}'
+
+
+def get_product_review(product_id, build):
+    # a build racing an invalidation stores its payload under the old version, where nobody reads it
+    key = product_review_key(
+        product_id,
+        get_version(product_review_version_key(product_id), REVIEW_CACHE_TIMEOUT),
+        get_model_version(ContractQuestion),
+    )
+    payload = cache.get(key)
+    if payload is not None:
+        _count(REVIEW_CACHE_HITS)
+        return payload
+
+    _count(REVIEW_CACHE_MISSES)
+    with primary_reads():
+        payload = build()
+    cache.set(key, payload, REVIEW_CACHE_TIMEOUT)
+    return payload
+
+
+async def aget_product_review(product_id, build):
+    # Django's cache backends implement aget()/aset() with sync_to_async, so awaiting each call
+    # would cost an executor hop per cache read; the whole lookup (and a miss's build) takes one
+    return await sync_to_async(get_product_review)(product_id, build)
+
+
+def invalidate_product_review(product_id):
+    # a new version rather than a delete, for the same reason as bump_model_version
+    cache.set(product_review_version_key(product_id), uuid.uuid4().hex, REVIEW_CACHE_TIMEOUT)
+
+
+def review_cache_stats():
+    return {
+        'hits': caches['local'].get(REVIEW_CACHE_HITS, 0),
+        'misses': caches['local'].get(REVIEW_CACHE_MISSES, 0),
+    }
+
+
+def cached_list_response(request, model, build):
+    version = get_model_version(model)
+    url_digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    etag = f'"{model._meta.model_name}-{version}-{url_digest[:16]}"'
+
+    conditional = get_conditional_response(request, etag=etag)
+    if conditional is not None:
+        return Response(status=conditional.status_code, headers={'ETag': etag})
+
+    key = f'list:{model._meta.label_lower}:{version}:{url_digest}'
+    data = get_cached(key, build, LIST_CACHE_TIMEOUT)
+    return Response(data, headers={'ETag': etag})
+
+
+class CachedListMixin:
+    """Serves list() from the two-level cache, keyed on the model's version."""
+
+    def is_list_cacheable(self, request):
+        return True
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_list_cacheable(request):
+            return super().list(request, *args, **kwargs)
+        return cached_list_response(
+            request,
+            self.get_queryset().model,
+            lambda: super(CachedListMixin, self).list(request, *args, **kwargs).data,
+        )
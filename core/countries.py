@@ -0,0 +1,63 @@
+import gzip
+import hashlib
+import json
+from functools import lru_cache
+
+from django.utils import translation
+from django_countries import countries
+
+from core.serializers import CountrySerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@lru_cache(maxsize=None)
+def country_payload(language):
+    # the list only changes with a release or a locale, so every encoding is built once per language
+    with translation.override(language):
+        countries_list = [{'value': code, 'label': name} for code, name in countries]
+        data = CountrySerializer(countries_list, many=True).data
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+    digest = hashlib.sha256(body).hexdigest()[:32]
+
+    variants = {None: (body, f'"{digest}"'), 'gzip': (gzip.compress(body, 9, mtime=0), f'"{digest}-gzip"')}
+    if brotli is not None:
+        variants['br'] = (brotli.compress(body), f'"{digest}-br"')
+    return variants
+
+
+def encoding_qualities(header):
+    qualities = {}
+    for part in header.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def accepts_encoding(request, encoding):
+    # an explicit entry wins over "*"; q=0 means "not acceptable"
+    qualities = encoding_qualities(request.headers.get('Accept-Encoding', ''))
+    return qualities.get(encoding, qualities.get('*', 0)) > 0
+
+
+def pick_country_variant(request, language):
+    variants = country_payload(language)
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accepts_encoding(request, encoding):
+            return encoding, *variants[encoding]
+    return None, *variants[None]
@@ -0,0 +1,41 @@
+import time
+
+from django.db import connections
+
+
+def pool_stats(alias='default'):
+    pool = getattr(connections[alias], 'pool', None)
+    if pool is None:
+        return None
+    stats = pool.get_stats()
+    queued = stats.get('requests_queued', 0)
+    return {
+        'size': stats.get('pool_size', 0),
+        'min_size': stats.get('pool_min', 0),
+        'max_size': stats.get('pool_max', 0),
+        'available': stats.get('pool_available', 0),
+        'checked_out': stats.get('pool_size', 0) - stats.get('pool_available', 0),
+        'waiting': stats.get('requests_waiting', 0),
+        'requests': stats.get('requests_num', 0),
+        'queued': queued,
+        'wait_ms_total': stats.get('requests_wait_ms', 0),
+        'wait_ms_avg': round(stats.get('requests_wait_ms', 0) / queued, 2) if queued else 0,
+        'timeouts': stats.get('requests_errors', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+    }
+
+
+def database_health(alias='default'):
+    connection = connections[alias]
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    return {
+        'alias': alias,
+        'vendor': connection.vendor,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'pooled': getattr(connection, 'pool', None) is not None,
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'pool': pool_stats(alias),
+    }
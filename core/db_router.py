@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+# per-request routing state, set by ReplicaPinMiddleware; outside a request everything uses the primary
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+def start_request():
+    state = {'replica': False, 'wrote': False}
+    return state, _request_state.set(state)
+
+
+def end_request(token):
+    _request_state.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Sends the reads inside the block to the primary, whatever the request opted into."""
+    state = _request_state.get()
+    replica = state is not None and state['replica']
+    if replica:
+        state['replica'] = False
+    try:
+        yield
+    finally:
+        if replica:
+            state['replica'] = True
+
+
+def current_read_alias():
+    state = _request_state.get()
+    # once the request has written anything, its reads must see that write
+    if state is None or not state['replica'] or state['wrote']:
+        return None
+    return settings.REPLICA_DATABASE
+
+
+class ReplicaRouter:
+    """Sends reads of opted-in safe requests to the replica, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        alias = current_read_alias()
+        if alias is None or alias not in connections.settings:
+            return None
+        # reads inside an open transaction on the primary must see that transaction's rows
+        # (this also keeps TestCase, which wraps every test in one, on the primary)
+        if connections['default'].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.REPLICA_DATABASE
@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from core.ledger import post_entry
+from core.models import Transaction, PayoutAccount
+
+# action: (states it can be taken from, resulting state, party allowed to take it)
+TRANSITIONS = {
+    'fund': (('CREATED',), 'FUNDED', 'buyer'),
+    'deliver': (('FUNDED',), 'DELIVERED', 'seller'),
+    'release': (('DELIVERED',), 'RELEASED', 'buyer'),
+    'dispute': (('FUNDED', 'DELIVERED'), 'DISPUTED', None),
+}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+class StaleTransaction(Exception):
+    pass
+
+
+def can_act(escrow, action, user):
+    party = TRANSITIONS[action][2]
+    if user.is_staff:
+        return True
+    if party is None:
+        return user.pk in (escrow.buyer_id, escrow.seller_id)
+    return getattr(escrow, f'{party}_id') == user.pk
+
+
+def apply_transition(escrow, action, version=None):
+    sources, target, _ = TRANSITIONS[action]
+    if escrow.state not in sources:
+        raise InvalidTransition(f'Cannot {action} a transaction that is {escrow.state}')
+    version = escrow.version if version is None else version
+
+    with transaction.atomic():
+        # compare-and-swap on version: no row lock is held between reading and writing
+        updated = Transaction.objects.filter(pk=escrow.pk, version=version, state__in=sources).update(
+            state=target,
+            version=F('version') + 1,
+            updated_at=now(),
+        )
+        if not updated:
+            raise StaleTransaction('Transaction was changed by another request')
+
+        if target == 'RELEASED':
+            account = PayoutAccount.objects.filter(user_id=escrow.seller_id).only('pk').first()
+            if account is None:
+                raise InvalidTransition('Seller has no payout account')
+            # keyed on the transaction, so a retried release can never credit twice
+            post_entry(
+                account.pk,
+                escrow.amount,
+                f'transaction:{escrow.pk}:release',
+                description=f'Release of transaction {escrow.pk}',
+            )
+
+    escrow.state = target
+    escrow.version = version + 1
+    return escrow
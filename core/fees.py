@@ -0,0 +1,48 @@
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+from core.cache import get_model_version
+from core.models import ProtectionFee
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+
+class FeeSchedule:
+    """All ProtectionFee rows folded into one flat part and one percentage part."""
+
+    def __init__(self, fees):
+        self.flat = sum((fee for fee, is_percent in fees if not is_percent), Decimal('0'))
+        self.percent = sum((fee for fee, is_percent in fees if is_percent), Decimal('0'))
+        self.rate = self.percent / HUNDRED
+
+    def quote(self, amount):
+        # Decimal throughout, rounded once to the cent
+        return (self.flat + Decimal(amount) * self.rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+_compiled = None
+_compile_lock = threading.Lock()
+
+
+def get_fee_schedule():
+    global _compiled
+    # ProtectionFee saves bump the model version, which is what triggers a recompile
+    version = get_model_version(ProtectionFee)
+    compiled = _compiled
+    if compiled is None or compiled[0] != version:
+        with _compile_lock:
+            compiled = _compiled
+            if compiled is None or compiled[0] != version:
+                fees = list(ProtectionFee.objects.values_list('fee', 'is_percent'))
+                compiled = _compiled = (version, FeeSchedule(fees))
+    return compiled[1]
+
+
+def quote_fee(amount):
+    return get_fee_schedule().quote(amount)
+
+
+def quote_fees(amounts):
+    schedule = get_fee_schedule()
+    return [schedule.quote(amount) for amount in amounts]
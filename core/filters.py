@@ -0,0 +1,44 @@
+from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
+
+from core.models import Product, User, PayoutAccount
+
+
+class ProductFilter(filters.FilterSet):
+    # ?amount_min=&amount_max=, ?fee_min=&fee_max=, ?created_at_after=&created_at_before=
+    amount = filters.RangeFilter()
+    fee = filters.RangeFilter()
+    created_at = filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = Product
+        fields = ['user', 'receiver', 'amount', 'fee', 'created_at']
+
+
+class UserFilter(filters.FilterSet):
+    group = filters.CharFilter(field_name='groups__name')
+    date_joined = filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = User
+        fields = ['group', 'is_active', 'date_joined']
+
+
+BALANCE_NOTE = (
+    'balance here is the indexed, materialized column, updated by the rollup_ledger command; '
+    'postings made since its last run are not included'
+)
+
+
+class PayoutAccountFilter(filters.FilterSet):
+    # filtering the ledger_balance annotation would aggregate every account's ledger per request
+    balance = filters.RangeFilter(help_text=f'Range on the balance ({BALANCE_NOTE}).')
+
+    class Meta:
+        model = PayoutAccount
+        fields = ['bank', 'balance']
+
+
+
+class PayoutAccountOrderingFilter(OrderingFilter):
+    ordering_description = f'Which field to use when ordering the results ({BALANCE_NOTE}).'
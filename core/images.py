@@ -0,0 +1,187 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.validators import validate_image_file_extension
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core.cache import invalidate_product_review
+from core.models import Product, Dispute
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_INGEST_WORKERS, thread_name_prefix='image-ingest')
+
+# bounding boxes for the resized copies served to list and detail screens
+IMAGE_SIZES = {
+    'thumb': (200, 200),
+    'medium': (800, 800),
+}
+IMAGE_FORMATS = {
+    'jpeg': 'jpg',
+    'webp': 'webp',
+}
+
+
+def stage_uploads(uploads):
+    # Django removes its own upload temp files when the request ends, so copy
+    # the uploads somewhere the worker can still read them afterwards
+    staging_root = settings.IMAGE_INGEST_STAGING_DIR
+    if staging_root:
+        os.makedirs(staging_root, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix='ingest-', dir=staging_root)
+
+    staged = []
+    for index, upload in enumerate(uploads):
+        path = os.path.join(staging_dir, str(index))
+        with open(path, 'wb') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
+        staged.append((path, os.path.basename(upload.name)))
+    return staging_dir, staged
+
+
+def validate_image(file):
+    validate_image_file_extension(file)
+    with Image.open(file) as image:
+        image.verify()
+    file.seek(0)
+
+
+def derivative_name(name, size, image_format):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{size}.{IMAGE_FORMATS[image_format]}'
+
+
+def delete_derivatives(name):
+    for size in IMAGE_SIZES:
+        for image_format in IMAGE_FORMATS:
+            default_storage.delete(derivative_name(name, size, image_format))
+
+
+def generate_derivatives(fieldfile):
+    # derivatives sit next to the original under MEDIA_ROOT with a predictable name,
+    # so serializers can link them without a lookup
+    with fieldfile.storage.open(fieldfile.name, 'rb') as source, Image.open(source) as original:
+        original = ImageOps.exif_transpose(original).convert('RGB')
+        for size, dimensions in IMAGE_SIZES.items():
+            variant = original.copy()
+            variant.thumbnail(dimensions)
+            for image_format in IMAGE_FORMATS:
+                name = derivative_name(fieldfile.name, size, image_format)
+                if default_storage.exists(name):
+                    continue
+                buffer = io.BytesIO()
+                variant.save(buffer, format=image_format.upper(), quality=85)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_derivatives_safely(fieldfile):
+    try:
+        generate_derivatives(fieldfile)
+    except Exception:
+        logger.exception(f"Derivative generation failed for {fieldfile.name}")
+
+
+def schedule_derivatives(fieldfile):
+    if fieldfile:
+        transaction.on_commit(lambda: executor.submit(run_in_worker, generate_derivatives_safely, fieldfile))
+
+
+def image_sizes(fieldfile, request=None):
+    if not fieldfile:
+        return {}
+    sizes = {}
+    for size in IMAGE_SIZES:
+        sizes[size] = {}
+        for image_format in IMAGE_FORMATS:
+            url = default_storage.url(derivative_name(fieldfile.name, size, image_format))
+            sizes[size][image_format] = request.build_absolute_uri(url) if request else settings.DEFAULT_HOST + url
+    return sizes
+
+
+def run_in_worker(func, *args):
+    # worker threads keep their own connections; drop stale ones around each job
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def ingest_images(model, image_field, parent_field, parent, uploads):
+    staging_dir, staged = stage_uploads(uploads)
+    transaction.on_commit(
+        lambda: executor.submit(
+            run_in_worker, persist_images, model, image_field, parent_field, parent, staging_dir, staged
+        )
+    )
+
+
+def persist_images(model, image_field, parent_field, parent, staging_dir, staged):
+    rows = []
+    try:
+        for path, name in staged:
+            with open(path, 'rb') as source:
+                upload = File(source, name=name)
+                validate_image(upload)
+                row = model(**{parent_field: parent})
+                getattr(row, image_field).save(name, upload, save=False)
+            rows.append(row)
+
+        # resized copies are written before the parent turns READY, so a client
+        # that sees READY can rely on the sizes map
+        for row in rows:
+            try:
+                generate_derivatives(getattr(row, image_field))
+            except Exception:
+                logger.exception(f"Derivative generation failed for {getattr(row, image_field).name}")
+
+        model.objects.bulk_create(rows)
+        image_status = 'READY'
+    except Exception:
+        logger.exception(f"Image ingestion failed for {parent._meta.label} {parent.pk}")
+        for row in rows:
+            getattr(row, image_field).delete(save=False)
+        image_status = 'FAILED'
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    type(parent).objects.filter(pk=parent.pk).update(image_status=image_status)
+    # bulk_create and update() send no signals, so the review payload is dropped here
+    if isinstance(parent, Product):
+        invalidate_product_review(parent.pk)
+    return image_status
+
+
+def recover_stale_ingestions(max_age):
+    """
+    Ingestion jobs only live in the executor's memory, so a restart or crash loses them. Parents
+    still PENDING after ``max_age`` are marked FAILED and staging directories that old are removed.
+    """
+    cutoff = timezone.now() - max_age
+    failed = 0
+    for model in (Product, Dispute):
+        stale = list(model.objects.filter(image_status='PENDING', updated_at__lt=cutoff).values_list('pk', flat=True))
+        failed += model.objects.filter(pk__in=stale, image_status='PENDING').update(image_status='FAILED')
+        if model is Product:
+            for product_id in stale:
+                invalidate_product_review(product_id)
+
+    removed = 0
+    staging_root = settings.IMAGE_INGEST_STAGING_DIR or tempfile.gettempdir()
+    if os.path.isdir(staging_root):
+        for entry in os.scandir(staging_root):
+            if entry.name.startswith('ingest-') and entry.is_dir() and entry.stat().st_mtime < cutoff.timestamp():
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+    return failed, removed
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+from core.models import PayoutAccount, LedgerEntry
+
+CENT = Decimal('0.01')
+
+
+def post_entry(account_id, amount, idempotency_key, description=''):
+    # a plain INSERT: the account row is never locked, so concurrent postings don't serialize
+    try:
+        with transaction.atomic():
+            entry = LedgerEntry.objects.create(
+                account_id=account_id,
+                amount=amount,
+                idempotency_key=idempotency_key,
+                description=description,
+            )
+        return entry, True
+    except IntegrityError:
+        # a retry of a posting that already landed
+        entry = LedgerEntry.objects.filter(idempotency_key=idempotency_key).first()
+        if entry is None:
+            raise
+        return entry, False
+
+
+def with_ledger_balance(queryset):
+    # materialized balance plus the delta that has not been rolled up yet, in one query
+    pending = Coalesce(
+        Sum('ledger_entries__amount', filter=Q(ledger_entries__rolled_up=False)),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    return queryset.annotate(ledger_balance=F('balance') + pending)
+
+
+def current_balance(account):
+    balance = getattr(account, 'ledger_balance', None)
+    if balance is None:
+        balance = with_ledger_balance(PayoutAccount.objects.filter(pk=account.pk)).values_list(
+            'ledger_balance', flat=True
+        ).get()
+    # some backends drop the scale of summed decimals
+    return Decimal(balance).quantize(CENT)
+
+
+def roll_up(account_id):
+    # folds pending entries into the materialized balance; postings made meanwhile are
+    # not locked by this and are picked up by the next run
+    with transaction.atomic():
+        PayoutAccount.objects.select_for_update().filter(pk=account_id).get()
+        entries = list(
+            LedgerEntry.objects.select_for_update()
+            .filter(account_id=account_id, rolled_up=False)
+            .values_list('id', 'amount')
+        )
+        if not entries:
+            return 0
+        total = sum((amount for _, amount in entries), Decimal('0'))
+        LedgerEntry.objects.filter(id__in=[entry_id for entry_id, _ in entries]).update(rolled_up=True)
+        PayoutAccount.objects.filter(pk=account_id).update(balance=F('balance') + total)
+    return len(entries)
+
+
+def pending_accounts():
+    return LedgerEntry.objects.filter(rolled_up=False).values_list('account_id', flat=True).distinct()
@@ -0,0 +1,74 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+
+from core.models import User, Product
+from core.serializers import CustomTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Fire concurrent requests through the ASGI handler at the sync DRF endpoints and their '
+        'async counterparts and compare throughput and latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User the requests are authenticated as')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+
+    def endpoints(self):
+        product = Product.objects.order_by('-id').only('id').first()
+        if product is None:
+            raise CommandError('Create some products first')
+        return [
+            ('product list', reverse('products-list'), reverse('async-products-list')),
+            ('product detail', reverse('products-detail', args=[product.pk]),
+             reverse('async-products-detail', args=[product.pk])),
+            ('review', reverse('products-review', args=[product.pk]),
+             reverse('async-products-review', args=[product.pk])),
+            ('dispute list', reverse('disputes-list'), reverse('async-disputes-list')),
+        ]
+
+    async def run(self, url, headers, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = 0
+
+        async def request():
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                failures += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(total)))
+        return latencies, time.perf_counter() - started, failures
+
+    def report(self, label, latencies, elapsed, failures):
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'  {label:<6} {len(latencies) / elapsed:8.1f} req/s  p50 {percentiles[49]:8.2f} ms  '
+            f'p95 {percentiles[94]:8.2f} ms  p99 {percentiles[98]:8.2f} ms  failed {failures}'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']}")
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        headers = {'Authorization': f'Bearer {token}'}
+
+        for name, sync_url, async_url in self.endpoints():
+            self.stdout.write(name)
+            for label, url in (('sync', sync_url), ('async', async_url)):
+                result = asyncio.run(self.run(url, headers, options['requests'], options['concurrency']))
+                self.report(label, *result)
@@ -0,0 +1,50 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import ORJSONRenderer, orjson
+from core.serializers import ProductSerializer, DisputeSerializer
+from core.views import ProductViewSet, DisputeViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare encode time and peak memory of the stdlib JSON renderer and the orjson renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Rows serialized per payload')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def payloads(self, limit):
+        products = list(ProductViewSet.queryset.order_by('-created_at', '-id')[:limit])
+        disputes = list(DisputeViewSet.queryset.order_by('-created_at', '-id')[:limit])
+        if not products:
+            raise CommandError('Create some products first')
+        # serializer output is what the renderers receive, so it is built once outside the timings
+        yield 'products', ProductSerializer(products, many=True).data
+        if disputes:
+            yield 'disputes', DisputeSerializer(disputes, many=True).data
+
+    def measure(self, renderer, data, rounds):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            body = renderer.render(data)
+        elapsed = (time.perf_counter() - started) / rounds * 1000
+
+        tracemalloc.start()
+        renderer.render(data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak, len(body)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed; ORJSONRenderer falls back to the stdlib'))
+        for name, data in self.payloads(options['limit']):
+            self.stdout.write(f'{name} ({len(data)} rows)')
+            for label, renderer in (('stdlib json', JSONRenderer()), ('orjson', ORJSONRenderer())):
+                elapsed, peak, size = self.measure(renderer, data, options['rounds'])
+                self.stdout.write(
+                    f'  {label:<12} {elapsed:8.2f} ms/encode  peak {peak / 1024:9.1f} KiB  body {size / 1024:9.1f} KiB'
+                )
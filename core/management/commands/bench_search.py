@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from core.models import Product
+from core.search import FullTextSearchFilter
+from core.views import ProductViewSet
+
+WORDS = (
+    'phone laptop tablet camera watch speaker headset charger keyboard monitor sofa chair table lamp '
+    'bicycle helmet jacket sneakers handbag wallet perfume blender kettle fridge stove generator '
+    'inverter battery printer router console controller guitar piano drum'
+).split()
+ADJECTIVES = 'new used refurbished original black white silver blue red wireless portable smart'.split()
+
+
+class Command(BaseCommand):
+    help = 'Seed a product corpus and time ?q= search against a plain icontains scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Products to create first (e.g. 1000000)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=50)
+
+    def seed(self, total, batch_size):
+        start = Product.objects.count()
+        created = 0
+        while created < total:
+            batch = []
+            for index in range(start + created, start + min(created + batch_size, total)):
+                words = random.sample(ADJECTIVES, 2) + random.sample(WORDS, 2)
+                batch.append(Product(
+                    # names are unique, so the index is part of it
+                    name=f"{' '.join(words)} {index}",
+                    description=' '.join(random.choices(ADJECTIVES + WORDS, k=20)),
+                ))
+            Product.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f'seeded {created}/{total}', ending='\r')
+        self.stdout.write('')
+
+    def time_queries(self, label, build, terms):
+        latencies = []
+        for term in terms:
+            started = time.perf_counter()
+            list(build(term)[:20].values_list('id', flat=True))
+            latencies.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(
+            f'{label:<22} mean {statistics.mean(latencies):8.2f} ms  '
+            f'p50 {statistics.median(latencies):8.2f} ms  max {max(latencies):8.2f} ms'
+        )
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'], options['batch_size'])
+        self.stdout.write(f'{Product.objects.count()} products on {connection.vendor}')
+
+        view = ProductViewSet()
+        search = FullTextSearchFilter()
+        terms = [random.choice(WORDS) for _ in range(options['queries'])]
+        # a misspelling of each term, which only the trigram match can still find
+        typos = [term[:-2] + term[-1] + term[-2] for term in terms]
+
+        def searched(term):
+            request = Request(RequestFactory().get('/', {'q': term}))
+            return search.filter_queryset(request, Product.objects.all(), view)
+
+        self.time_queries('icontains scan', lambda term: Product.objects.filter(
+            name__icontains=term
+        ) | Product.objects.filter(description__icontains=term), terms)
+        self.time_queries('?q= search', searched, terms)
+        self.time_queries('?q= search, typos', searched, typos)
@@ -0,0 +1,83 @@
+import copy
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.utils import ConnectionHandler
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare per-request query latency with a fresh connection per request, persistent '
+        'connections and (on PostgreSQL with psycopg 3) the connection pool'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Simulated requests per worker')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--pool-size', type=int, default=8)
+        parser.add_argument('--database', default='default')
+
+    def modes(self, options):
+        base = copy.deepcopy(settings.DATABASES[options['database']])
+        base.get('OPTIONS', {}).pop('pool', None)
+
+        fresh = dict(base, CONN_MAX_AGE=0)
+        persistent = dict(base, CONN_MAX_AGE=None, CONN_HEALTH_CHECKS=True)
+        modes = [('fresh', fresh), ('persistent', persistent)]
+        if base['ENGINE'] == 'django.db.backends.postgresql':
+            pooled = dict(base, CONN_MAX_AGE=0)
+            pooled['OPTIONS'] = dict(base.get('OPTIONS', {}), pool={
+                'min_size': options['pool_size'],
+                'max_size': options['pool_size'],
+            })
+            modes.append(('pool', pooled))
+        return modes
+
+    def run_mode(self, database, options):
+        # ConnectionHandler insists on a 'default' entry, but only 'loadtest' is ever connected,
+        # so a pool built here never collides with the app's own 'default' pool
+        handler = ConnectionHandler({'default': database, 'loadtest': database})
+        # resolved once here rather than raced by the worker threads
+        handler.settings
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            connection = handler['loadtest']
+            timings = []
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                # what the request_finished signal does at the end of every request
+                connection.close_if_unusable_or_obsolete()
+                timings.append((time.perf_counter() - started) * 1000)
+            connection.close()
+            with lock:
+                latencies.extend(timings)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if database.get('OPTIONS', {}).get('pool'):
+            handler['loadtest'].close_pool()
+        return latencies, elapsed
+
+    def handle(self, *args, **options):
+        for name, database in self.modes(options):
+            latencies, elapsed = self.run_mode(database, options)
+            percentiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                f'{name:<11} {len(latencies) / elapsed:9.1f} req/s  '
+                f'mean {statistics.mean(latencies):7.2f} ms  '
+                f'p50 {percentiles[49]:7.2f} ms  p95 {percentiles[94]:7.2f} ms  p99 {percentiles[98]:7.2f} ms'
+            )
@@ -0,0 +1,23 @@
+from functools import partial
+
+from django.core.management.base import BaseCommand
+
+from core.images import executor, generate_derivatives_safely, run_in_worker
+from core.models import ProductImage, DisputeImage, User
+
+
+class Command(BaseCommand):
+    help = 'Generate thumb and medium derivatives for images uploaded before they were produced automatically'
+
+    def handle(self, *args, **options):
+        fieldfiles = []
+        for image in ProductImage.objects.only('image').iterator():
+            fieldfiles.append(image.image)
+        for image in DisputeImage.objects.exclude(photo='').exclude(photo=None).only('photo').iterator():
+            fieldfiles.append(image.photo)
+        for user in User.objects.exclude(photo_url='').exclude(photo_url=None).only('photo_url').iterator():
+            fieldfiles.append(user.photo_url)
+
+        # existing derivatives are skipped, so the command is safe to re-run
+        list(executor.map(partial(run_in_worker, generate_derivatives_safely), fieldfiles))
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(fieldfiles)} images'))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.images import recover_stale_ingestions
+
+
+class Command(BaseCommand):
+    help = 'Fail image uploads left PENDING by a restart and remove their staging directories'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=60,
+            help='Minutes an upload may stay PENDING before it is considered lost (default 60)',
+        )
+
+    def handle(self, *args, **options):
+        # run from cron or on deploy; uploads still in a live worker's queue are younger than --max-age
+        failed, removed = recover_stale_ingestions(timedelta(minutes=options['max_age']))
+        self.stdout.write(self.style.SUCCESS(f'Marked {failed} uploads FAILED, removed {removed} staging directories'))
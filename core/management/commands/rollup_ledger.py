@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.ledger import pending_accounts, roll_up
+
+
+class Command(BaseCommand):
+    help = 'Fold pending ledger entries into the materialized PayoutAccount balances'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type=float, default=None,
+            help='Keep running and roll up every this many seconds; the ?balance filter and ordering '
+                 'of payout accounts are only as fresh as the last roll-up',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.roll_up_all()
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
+            close_old_connections()
+
+    def roll_up_all(self):
+        accounts = entries = 0
+        # each account is rolled up in its own short transaction
+        for account_id in list(pending_accounts()):
+            entries += roll_up(account_id)
+            accounts += 1
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {entries} entries across {accounts} accounts'))
@@ -0,0 +1,121 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOB_RE = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/(?P<name>[0-9a-f]{64}[.\w]*)$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# anything not content-addressed can change under the same name, so clients revalidate
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+
+def media_etag(path, stat_result):
+    # blobs (and their derivatives) are named after the sha256 of the original, so the
+    # name is already a strong validator; anything else falls back to size and mtime
+    match = BLOB_RE.match(path)
+    if match:
+        return f'"{match.group("name")}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def set_validators(response, path, etag):
+    # shared by the 200/206 and the 304 so a revalidated copy keeps its caching policy
+    response['ETag'] = etag
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if BLOB_RE.match(path) else REVALIDATE_CACHE_CONTROL
+    return response
+
+
+def parse_range(header, size):
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(full_path, start, length, block_size=64 * 1024):
+    with open(full_path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat_result = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404
+
+    etag = media_etag(path, stat_result)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat_result.st_mtime))
+    if not_modified is not None:
+        return set_validators(not_modified, path, etag)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    size = stat_result.st_size
+
+    if settings.MEDIA_SERVE_MODE == 'accel':
+        # the front proxy serves the bytes (and ranges) from its internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+    elif settings.MEDIA_SERVE_MODE == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        byte_range = None
+        range_header = request.headers.get('Range')
+        # If-Range only allows a partial response while the client's copy is still current
+        if range_header and request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                read_range(full_path, start, length), status=206, content_type=content_type
+            )
+            response['Content-Length'] = length
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = size
+        response['Accept-Ranges'] = 'bytes'
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(stat_result.st_mtime)
+    return set_validators(response, path, etag)
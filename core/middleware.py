@@ -0,0 +1,73 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from core.db_router import start_request, end_request
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaPinMiddleware:
+    """
+    Lets safe requests to views with ``replica_reads = True`` read from the replica, unless the
+    client wrote recently: any write sets a cookie that pins it to the primary for
+    REPLICA_PIN_SECONDS, long enough for the replica to catch up.
+    """
+
+    sync_capable = True
+    # a sync-only middleware would push the async views back onto a thread
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state, token = start_request()
+        request.replica_state = state
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.pin(request, response, state)
+
+    async def __acall__(self, request):
+        state, token = start_request()
+        request.replica_state = state
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.pin(request, response, state)
+
+    def pin(self, request, response, state):
+        if state['wrote'] or request.method not in SAFE_METHODS:
+            pinned_until = time.time() + settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE,
+                f'{pinned_until:.3f}',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if (
+            request.method in SAFE_METHODS
+            and getattr(view_class, 'replica_reads', False)
+            and not self.is_pinned(request)
+        ):
+            request.replica_state['replica'] = True
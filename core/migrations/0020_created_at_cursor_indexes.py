@@ -0,0 +1,34 @@
+# Generated by Django 5.1 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0019_alter_user_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bank',
+            index=models.Index(fields=['-created_at', '-id'], name='bank_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispute',
+            index=models.Index(fields=['-created_at', '-id'], name='dispute_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payoutaccount',
+            index=models.Index(fields=['-created_at', '-id'], name='payout_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-created_at', '-id'], name='user_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_created_at_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispute',
+            name='image_status',
+            field=models.CharField(choices=[('PENDING', 'PENDING'), ('READY', 'READY'), ('FAILED', 'FAILED')], default='READY', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_status',
+            field=models.CharField(choices=[('PENDING', 'PENDING'), ('READY', 'READY'), ('FAILED', 'FAILED')], default='READY', max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('idempotency_key', models.CharField(max_length=100, unique=True)),
+                ('rolled_up', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='core.payoutaccount')),
+            ],
+            options={
+                'db_table': 'ledger_entries',
+                'indexes': [models.Index(fields=['account', '-created_at', '-id'], name='ledger_account_created_idx'), models.Index(condition=models.Q(('rolled_up', False)), fields=['account'], name='ledger_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_ledger_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('fee', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('state', models.CharField(choices=[('CREATED', 'CREATED'), ('FUNDED', 'FUNDED'), ('DELIVERED', 'DELIVERED'), ('RELEASED', 'RELEASED'), ('DISPUTED', 'DISPUTED')], default='CREATED', max_length=20)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('buyer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.product')),
+                ('seller', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='seller', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'transactions',
+                'indexes': [models.Index(fields=['state', '-created_at', '-id'], name='transaction_state_created_idx'), models.Index(fields=['-created_at', '-id'], name='transaction_created_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_escrow_transactions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dispute',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='dispute_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispute',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['-created_at', '-id'], name='dispute_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1 on 2026-10-18 14:10
+
+from django.db import migrations
+
+# weighted tsvector expressions, kept up to date by PostgreSQL as generated columns
+SEARCH_VECTORS = {
+    'core_product': (
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+    ),
+    'core_dispute': "to_tsvector('english', coalesce(description, ''))",
+    'core_faqs': (
+        "setweight(to_tsvector('english', coalesce(question, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(answer, '')), 'B')"
+    ),
+}
+TRIGRAM_COLUMNS = {
+    'core_product': 'name',
+    'core_faqs': 'question',
+}
+
+
+def add_search_columns(apps, schema_editor):
+    # the columns are invisible to the models; other databases search with icontains instead
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, expression in SEARCH_VECTORS.items():
+        schema_editor.execute(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({expression}) STORED'
+        )
+        schema_editor.execute(f'CREATE INDEX {table}_search_idx ON {table} USING gin (search_vector)')
+    for table, column in TRIGRAM_COLUMNS.items():
+        schema_editor.execute(f'CREATE INDEX {table}_{column}_trgm_idx ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+def remove_search_columns(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in TRIGRAM_COLUMNS.items():
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm_idx')
+    for table in SEARCH_VECTORS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+        schema_editor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_dispute_status_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_columns, remove_search_columns),
+    ]
@@ -1,8 +1,16 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 
+from core.storage import content_addressed_storage
 from core.utils import CustomUserManager
 
+IMAGE_STATUS_CHOICES = [
+    ('PENDING', 'PENDING'),
+    ('READY', 'READY'),
+    ('FAILED', 'FAILED'),
+]
+
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
@@ -11,18 +19,76 @@ class User(AbstractUser):
     notify_on_request = models.BooleanField(default=False)
     notify_on_payment = models.BooleanField(default=False)
     notify_on_milestone = models.BooleanField(default=False)
-    photo_url = models.ImageField(upload_to='photos/%Y/%m/%d/', blank=True, null=True)
-    created_at = models.DateTimeField(auto_now=True)
+    photo_url = models.ImageField(
+        upload_to='photos/%Y/%m/%d/', storage=content_addressed_storage, blank=True, null=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     objects = CustomUserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='user_created_id_idx'),
+            models.Index(fields=['is_active', 'date_joined'], name='user_active_joined_idx'),
+            models.Index(fields=['date_joined', 'id'], name='user_joined_idx'),
+        ]
+
+
+class TokenRevocation(models.Model):
+    # one row per user: tokens issued before revoked_at (epoch seconds) are rejected; kept in the
+    # database because a cache may evict the marker and silently accept the token again
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    revoked_at = models.FloatField()
+
+    class Meta:
+        db_table = 'token_revocations'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.revoked_at}'
+
+
+class MediaBlob(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'media_blobs'
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name, size):
+        if cls.objects.filter(name=name).update(refcount=F('refcount') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, size=size, refcount=1)
+        except IntegrityError:
+            # another upload of the same content created the row first
+            cls.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    @classmethod
+    def release(cls, name, delete_file):
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refcount > 1:
+                cls.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            # last reference: remove the file while holding the row lock
+            delete_file()
+            if blob is not None:
+                blob.delete()
+
 
 class Bank(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -30,6 +96,9 @@ class Bank(models.Model):
 
     class Meta:
         db_table = 'banks'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='bank_created_id_idx'),
+        ]
 
 
 class PayoutAccount(models.Model):
@@ -38,16 +107,40 @@ class PayoutAccount(models.Model):
     account_name = models.CharField(max_length=100)
     bank = models.ForeignKey(Bank, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'payout_accounts'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='payout_created_id_idx'),
+            models.Index(fields=['balance', 'id'], name='payout_balance_idx'),
+        ]
 
     def __str__(self):
         return f'{self.account_name} - {self.account_number}'
 
 
+class LedgerEntry(models.Model):
+    account = models.ForeignKey(PayoutAccount, on_delete=models.PROTECT, related_name='ledger_entries')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    description = models.CharField(max_length=255, blank=True)
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    rolled_up = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ledger_entries'
+        indexes = [
+            models.Index(fields=['account', '-created_at', '-id'], name='ledger_account_created_idx'),
+            # only the entries not yet folded into PayoutAccount.balance are ever summed
+            models.Index(fields=['account'], condition=models.Q(rolled_up=False), name='ledger_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.account_id}: {self.amount} ({self.idempotency_key})'
+
+
 class Product(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='receiver')
@@ -55,17 +148,28 @@ class Product(models.Model):
     description = models.TextField(null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    created_at = models.DateTimeField(auto_now=True)
+    image_status = models.CharField(choices=IMAGE_STATUS_CHOICES, default='READY', max_length=20)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            # ProductFilter / ordering: a seller's or receiver's products newest first, amount and fee ranges
+            models.Index(fields=['user', '-created_at', '-id'], name='product_user_created_idx'),
+            models.Index(fields=['receiver', '-created_at', '-id'], name='product_receiver_created_idx'),
+            models.Index(fields=['amount', 'id'], name='product_amount_idx'),
+            models.Index(fields=['fee', 'id'], name='product_fee_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='uploads/%Y/%m/%d/')
-    created_at = models.DateTimeField(auto_now=True)
+    image = models.ImageField(upload_to='uploads/%Y/%m/%d/', storage=content_addressed_storage)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -75,7 +179,7 @@ class ProductImage(models.Model):
 class ContractQuestion(models.Model):
     question = models.TextField()
     additions = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -87,7 +191,7 @@ class Agreement(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     question = models.ForeignKey(ContractQuestion, on_delete=models.CASCADE)
     answer = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -100,7 +204,7 @@ class Agreement(models.Model):
 class DisputeReason(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     reason = models.TextField()
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -117,17 +221,30 @@ class Dispute(models.Model):
     reason = models.ForeignKey(DisputeReason, on_delete=models.CASCADE, null=False, blank=False)
     description = models.TextField(null=True, blank=True)
     status = models.CharField(choices=DISPUTE_CHOICES, default='PENDING', max_length=50)
-    created_at = models.DateTimeField(auto_now=True)
+    image_status = models.CharField(choices=IMAGE_STATUS_CHOICES, default='READY', max_length=20)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='dispute_created_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='dispute_status_created_idx'),
+            # the admin queue only ever looks at open disputes, which stay a small slice of the table
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(status='PENDING'), name='dispute_pending_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.description
 
 
 class DisputeImage(models.Model):
     dispute = models.ForeignKey(Dispute, on_delete=models.CASCADE)
-    photo = models.ImageField(upload_to='uploads/%Y/%m/%d/', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True)
+    photo = models.ImageField(
+        upload_to='uploads/%Y/%m/%d/', storage=content_addressed_storage, null=True, blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -139,7 +256,7 @@ class ProtectionFee(models.Model):
     name = models.CharField(max_length=100, unique=True)
     fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     is_percent = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -150,13 +267,33 @@ class FAQs(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     question = models.TextField()
     answer = models.TextField()
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
 
-# class Transaction(models.Model):
-#     buyer = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-#     seller = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='seller')
-#     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-#     amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-#     created_at = models.DateTimeField(auto_now=True)
-#     updated_at = models.DateTimeField(auto_now=True)
+class Transaction(models.Model):
+    STATE_CHOICES = [
+        ('CREATED', 'CREATED'),
+        ('FUNDED', 'FUNDED'),
+        ('DELIVERED', 'DELIVERED'),
+        ('RELEASED', 'RELEASED'),
+        ('DISPUTED', 'DISPUTED'),
+    ]
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='seller')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    state = models.CharField(choices=STATE_CHOICES, default='CREATED', max_length=20)
+    version = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'transactions'
+        indexes = [
+            models.Index(fields=['state', '-created_at', '-id'], name='transaction_state_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='transaction_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.state}'
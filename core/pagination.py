@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    # (created_at, id) keeps the ordering unique, so the cursor can seek on the
+    # composite index instead of counting through an OFFSET on deep pages
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchResultsPagination(LimitOffsetPagination):
+    # ranked results are ordered by relevance, which a (created_at, id) cursor cannot seek on
+    default_limit = 20
+    max_limit = 100
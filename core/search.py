@@ -0,0 +1,84 @@
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+from core.pagination import SearchResultsPagination
+
+SEARCH_PARAM = 'q'
+SEARCH_CONFIG = 'english'
+
+
+def search_query(request):
+    return request.query_params.get(SEARCH_PARAM, '').strip() if request is not None else ''
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    ``?q=`` search over the view's ``search_fields``.
+
+    On PostgreSQL this matches the generated ``search_vector`` column (GIN indexed, see migration
+    0026) and, when the view names a ``search_trigram_field``, also trigram word similarity on it
+    so misspelt queries still match; results are ordered by rank. Other databases fall back to
+    an unranked icontains over the same fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = search_query(request)
+        if not query:
+            return queryset
+        if connections[queryset.db].vendor == 'postgresql':
+            return self.ranked(queryset, query, getattr(view, 'search_trigram_field', None))
+        condition = Q()
+        for field in view.search_fields:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition).order_by('-created_at', '-id')
+
+    def ranked(self, queryset, query, trigram_field):
+        table = queryset.model._meta.db_table
+        vector = f'"{table}"."search_vector"'
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        match, match_params = f'{vector} @@ {tsquery}', [query]
+        rank, rank_params = f'ts_rank_cd({vector}, {tsquery})', [query]
+
+        if trigram_field:
+            column = f'"{table}"."{queryset.model._meta.get_field(trigram_field).column}"'
+            # <% is word similarity, served by the gin_trgm_ops index
+            match, match_params = f'({match} OR %s <%% {column})', match_params + [query]
+            rank, rank_params = f'({rank} + word_similarity(%s, {column}))', rank_params + [query]
+
+        return queryset.filter(
+            RawSQL(match, match_params, output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(rank, rank_params, output_field=FloatField())
+        ).order_by('-search_rank', '-id')
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': SEARCH_PARAM,
+            'required': False,
+            'in': 'query',
+            'description': f"Search {', '.join(view.search_fields)}",
+            'schema': {'type': 'string'},
+        }]
+
+
+class SearchMixin:
+    """
+    Pages ranked search results by offset instead of the created_at cursor. Views whose list is
+    not paginated set ``paginate_search = False`` so a search keeps the same bare-list shape.
+    """
+
+    search_fields = ()
+    search_trigram_field = None
+    paginate_search = True
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and search_query(self.request):
+            self._paginator = SearchResultsPagination() if self.paginate_search else None
+        return super().paginator
+
+    def is_list_cacheable(self, request):
+        # free-text queries would each become a separate day-long entry and evict the real ones
+        return not search_query(request) and super().is_list_cacheable(request)
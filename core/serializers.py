@@ -1,15 +1,25 @@
+import time
+from decimal import Decimal
+
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.utils.timezone import now
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer, \
     TokenVerifySerializer
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import UntypedToken, RefreshToken
 
+from core.activity import login_activity
+from core.authentication import add_user_claims, is_token_revoked
+from core.cache import get_contract_questions, invalidate_product_review
+from core.fees import quote_fee
+from core.images import ingest_images, image_sizes
+from core.ledger import current_balance
 from core.models import User, Bank, PayoutAccount, Product, ProductImage, ContractQuestion, DisputeReason, Dispute, \
-    ProtectionFee, Agreement, DisputeImage, FAQs
+    ProtectionFee, Agreement, DisputeImage, FAQs, LedgerEntry, Transaction
+from core.sparse import DynamicFieldsMixin, collapsed_to_pk
 from core.utils import generate_random_string, generate_referral_code
 
 
@@ -22,14 +32,16 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
-        return token
+        token['auth_time'] = time.time()
+        # permission checks read these claims instead of loading the user on every request
+        return add_user_claims(token, user)
 
     def validate(self, attrs):
         data = super().validate(attrs)
         user = self.user
         if user:
-            UserModel = get_user_model()
-            UserModel.objects.filter(pk=user.pk).update(last_login=now())
+            # buffered and written in bulk off the request path
+            login_activity.record(user.pk)
         return data
 
 
@@ -49,14 +61,22 @@ class CustomTokenVerifySerializer(TokenVerifySerializer):
 class CustomTokenRefreshSerializer(TokenRefreshSerializer):
     def validate(self, attrs):
         refresh = RefreshToken(attrs['refresh'])
-        data = {'access': str(refresh.access_token)}
+        if is_token_revoked(refresh):
+            raise InvalidToken("Token has been revoked")
+
+        # refresh the claims from the database so group or staff changes reach the next access token
+        user = User.objects.filter(pk=refresh[api_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise InvalidToken("User is inactive or no longer exists")
+        access = add_user_claims(refresh.access_token, user)
+        data = {'access': str(access)}
 
         # Custom logic here (e.g., logging)
 
         return data
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -97,10 +117,14 @@ class UserNotificationSettingsSerializer(serializers.ModelSerializer):
 
 class UserProfilePhotoSerializer(serializers.ModelSerializer):
     photo_url = serializers.ImageField(required=True)
+    sizes = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = User
-        fields = ['photo_url']
+        fields = ['photo_url', 'sizes']
+
+    def get_sizes(self, obj) -> dict:
+        return image_sizes(obj.photo_url, self.context.get('request'))
 
 
 class UserDataSerializer(serializers.ModelSerializer):
@@ -109,7 +133,7 @@ class UserDataSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'groups']
 
 
-class BankSerializer(serializers.ModelSerializer):
+class BankSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Bank
         fields = ['id', 'name', 'description']
@@ -117,28 +141,43 @@ class BankSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context['request'].user
-        bank = Bank.objects.create(**validated_data, user=user if user else None)
+        bank = Bank.objects.create(**validated_data, user_id=user.pk)
         return bank
 
 
-class PayoutAccountSerializer(serializers.ModelSerializer):
+class PayoutAccountSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    # balances only move through ledger postings
+    balance = serializers.SerializerMethodField(read_only=True)
+
     class Meta:
         model = PayoutAccount
         fields = '__all__'
         read_only_fields = ['id']
         db_table = 'payout_accounts'
 
+    def get_balance(self, obj) -> str:
+        return str(current_balance(obj))
+
     def create(self, validated_data):
         payout_account = PayoutAccount.objects.create(**validated_data)
         return payout_account
 
 
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LedgerEntry
+        fields = ['id', 'account', 'amount', 'description', 'idempotency_key', 'created_at']
+        read_only_fields = ['id', 'account', 'created_at']
+        extra_kwargs = {'idempotency_key': {'validators': []}}
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField(read_only=True)
+    sizes = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'sizes']
 
     def get_image(self, obj) -> str:
         request = self.context.get('request')
@@ -146,8 +185,11 @@ class ProductImageSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.image.url) if request else settings.DEFAULT_HOST + obj.image.url
         return None
 
+    def get_sizes(self, obj) -> dict:
+        return image_sizes(obj.image, self.context.get('request'))
+
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     photo = serializers.ListField(
         child=serializers.ImageField(),
         required=True,
@@ -156,15 +198,17 @@ class ProductSerializer(serializers.ModelSerializer):
     images = serializers.SerializerMethodField(read_only=True)
     user = UserDataSerializer(read_only=True)
     receiver = UserDataSerializer(read_only=True)
+    expandable_fields = {'user': collapsed_to_pk, 'receiver': collapsed_to_pk, 'images': None}
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'amount', 'fee', 'photo', 'images', 'user', 'receiver']
-        read_only_fields = ['id', 'user', 'receiver']
+        fields = ['id', 'name', 'description', 'amount', 'fee', 'photo', 'images', 'image_status', 'user', 'receiver']
+        read_only_fields = ['id', 'fee', 'user', 'receiver', 'image_status']
 
     def get_images(self, obj) -> list:
-        photos = ProductImage.objects.filter(product=obj)
-        serializer = ProductImageSerializer(photos, many=True)
+        # read through the related manager so a prefetched productimage_set is reused
+        photos = obj.productimage_set.all()
+        serializer = ProductImageSerializer(photos, many=True, context=self.context)
         return serializer.data
 
     def create(self, validated_data):
@@ -174,17 +218,28 @@ class ProductSerializer(serializers.ModelSerializer):
         # Extract the photo data from the validated data
         photos = validated_data.pop('photo')
 
+        # The protection fee is always priced server-side from the fee schedule
+        validated_data['fee'] = quote_fee(validated_data.get('amount', 0))
+
         # Create the product instance
-        product = Product.objects.create(**validated_data, user=user)
+        product = Product.objects.create(
+            **validated_data, user_id=user.pk, image_status='PENDING' if photos else 'READY'
+        )
 
-        # Iterate over the photo data and create ProductImage instances
-        for photo in photos:
-            ProductImage.objects.create(product=product, image=photo)
+        # The photos are written by the ingestion workers once the product is committed
+        if photos:
+            ingest_images(ProductImage, 'image', 'product', product, photos)
 
         return product
 
+    def update(self, instance, validated_data):
+        validated_data.pop('photo', None)
+        if 'amount' in validated_data:
+            validated_data['fee'] = quote_fee(validated_data['amount'])
+        return super().update(instance, validated_data)
+
 
-class ContractQuestionSerializer(serializers.ModelSerializer):
+class ContractQuestionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ContractQuestion
         fields = ['id', 'question', 'additions']
@@ -202,7 +257,7 @@ class DisputeStatusSerializer(serializers.Serializer):
     status = serializers.CharField()
 
 
-class DisputeSerializer(serializers.ModelSerializer):
+class DisputeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     image = serializers.ListField(
         child=serializers.ImageField(),
         required=True,
@@ -213,6 +268,12 @@ class DisputeSerializer(serializers.ModelSerializer):
     dispute_photos = serializers.SerializerMethodField(read_only=True)
     product = serializers.SerializerMethodField(read_only=True)
     user = UserDataSerializer(read_only=True)
+    expandable_fields = {
+        'user': collapsed_to_pk,
+        'product': collapsed_to_pk,
+        'reason': collapsed_to_pk,
+        'dispute_photos': None,
+    }
 
     class Meta:
         model = Dispute
@@ -227,19 +288,21 @@ class DisputeSerializer(serializers.ModelSerializer):
             'dispute_photos',
             'product_id',
             'reason_id',
-            'status'
+            'status',
+            'image_status'
         ]
+        read_only_fields = ['image_status']
         depth = 1
         write_only_fields = ['reason_id', 'product_id']
 
     def get_dispute_photos(self, obj) -> list:
-        photos = DisputeImage.objects.filter(dispute=obj)
-        serializer = DisputeImageSerializer(photos, many=True)
+        photos = obj.disputeimage_set.all()
+        serializer = DisputeImageSerializer(photos, many=True, context=self.context)
         return serializer.data
 
     def get_product(self, obj) -> dict:
-        product = Product.objects.filter(id=obj.product.id).first()
-        serializer = ProductSerializer(product)
+        # obj.product is already loaded, re-fetching it would cost a query per dispute
+        serializer = ProductSerializer(obj.product, context=self.context)
         return serializer.data
 
     def create(self, validated_data):
@@ -249,12 +312,14 @@ class DisputeSerializer(serializers.ModelSerializer):
         # Extract the photo data from the validated data
         photos = validated_data.pop('image')
 
-        # Create the product instance
-        dispute = Dispute.objects.create(**validated_data, user=user)
+        # Create the dispute instance
+        dispute = Dispute.objects.create(
+            **validated_data, user_id=user.pk, image_status='PENDING' if photos else 'READY'
+        )
 
-        # Iterate over the photo data and create ProductImage instances
-        for photo in photos:
-            DisputeImage.objects.create(dispute=dispute, photo=photo)
+        # The photos are written by the ingestion workers once the dispute is committed
+        if photos:
+            ingest_images(DisputeImage, 'photo', 'dispute', dispute, photos)
 
         return dispute
 
@@ -266,7 +331,94 @@ class AgreementSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'created_at', 'updated_at',)
 
 
-class ProtectionFeeSerializer(serializers.ModelSerializer):
+class TransactionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        fields = ['id', 'product', 'buyer', 'seller', 'amount', 'fee', 'state', 'version', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'buyer', 'seller', 'amount', 'fee', 'state', 'version', 'created_at', 'updated_at']
+
+    def validate_product(self, product):
+        user = self.context['request'].user
+        if not user.is_staff and user.pk not in (product.user_id, product.receiver_id):
+            raise serializers.ValidationError('You are not a party to this product')
+        return product
+
+    def create(self, validated_data):
+        product = validated_data['product']
+        # the deal terms are copied so the transaction answers for itself without joins
+        return Transaction.objects.create(
+            product=product,
+            buyer_id=product.receiver_id,
+            seller_id=product.user_id,
+            amount=product.amount,
+            fee=product.fee,
+        )
+
+
+class TransactionTransitionSerializer(serializers.Serializer):
+    version = serializers.IntegerField(required=False, min_value=1)
+
+
+class FeeQuoteSerializer(serializers.Serializer):
+    amounts = serializers.ListField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0')),
+        allow_empty=False,
+        max_length=10000,
+    )
+
+
+class AgreementAnswerSerializer(serializers.Serializer):
+    question = serializers.IntegerField()
+    answer = serializers.BooleanField()
+
+
+class AgreementBulkSerializer(serializers.Serializer):
+    answers = AgreementAnswerSerializer(many=True, allow_empty=False)
+
+    def validate_answers(self, answers):
+        question_ids = [answer['question'] for answer in answers]
+        if len(set(question_ids)) != len(question_ids):
+            raise serializers.ValidationError("Each question can only be answered once")
+
+        questions = get_contract_questions(
+            lambda: ContractQuestionSerializer(ContractQuestion.objects.all(), many=True).data
+        )
+        unknown = set(question_ids) - {question['id'] for question in questions}
+        if unknown:
+            raise serializers.ValidationError(f"Unknown questions: {sorted(unknown)}")
+        return answers
+
+    def create(self, validated_data):
+        receiver_id = self.context['request'].user.pk
+        product = self.context['product']
+
+        # one read of what the receiver already answered, so unchanged answers are not rewritten
+        existing = {
+            agreement.question_id: agreement
+            for agreement in Agreement.objects.filter(receiver_id=receiver_id, product=product)
+        }
+        changed = [
+            Agreement(receiver_id=receiver_id, product=product, question_id=item['question'], answer=item['answer'])
+            for item in validated_data['answers']
+            if item['question'] not in existing or existing[item['question']].answer != item['answer']
+        ]
+
+        with transaction.atomic():
+            if changed:
+                Agreement.objects.bulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=['receiver', 'product', 'question'],
+                    update_fields=['answer', 'created_at', 'updated_at'],
+                )
+            # bulk_create sends no post_save, so drop the cached review payload here
+            transaction.on_commit(lambda: invalidate_product_review(product.pk))
+
+        existing.update({agreement.question_id: agreement for agreement in changed})
+        return [existing[item['question']] for item in validated_data['answers']]
+
+
+class ProtectionFeeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ProtectionFee
         fields = '__all__'
@@ -274,7 +426,7 @@ class ProtectionFeeSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context['request'].user
-        return ProtectionFee.objects.create(**validated_data, user=user)
+        return ProtectionFee.objects.create(**validated_data, user_id=user.pk)
 
 
 class ProductReviewSerializer(serializers.ModelSerializer):
@@ -289,22 +441,24 @@ class ProductReviewSerializer(serializers.ModelSerializer):
         depth = 1
 
     def get_photos(self, obj) -> list:
-        photo = ProductImage.objects.filter(product=obj)
+        photo = obj.productimage_set.all()
         return ProductImageSerializer(photo, many=True).data
 
     def get_questions(self, obj) -> list:
-        questions = ContractQuestion.objects.all()
-        serializer = ContractQuestionSerializer(questions, many=True)
-        return serializer.data
+        # the question set rarely changes, so it is served from a versioned cache
+        return get_contract_questions(
+            lambda: ContractQuestionSerializer(ContractQuestion.objects.all(), many=True).data
+        )
 
     def get_agreement(self, obj) -> list:
-        agreement = Agreement.objects.filter(product=obj)
+        agreement = obj.agreement_set.all()
         serializer = AgreementSerializer(agreement, many=True)
         return serializer.data
 
 
 class DisputeImageSerializer(serializers.ModelSerializer):
     photo = serializers.SerializerMethodField(read_only=True)
+    sizes = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = DisputeImage
@@ -316,8 +470,11 @@ class DisputeImageSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.photo.url) if request else settings.DEFAULT_HOST + obj.photo.url
         return None
 
+    def get_sizes(self, obj) -> dict:
+        return image_sizes(obj.photo, self.context.get('request'))
+
 
-class FAQsSerializer(serializers.ModelSerializer):
+class FAQsSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = FAQs
         fields = '__all__'
@@ -325,4 +482,4 @@ class FAQsSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context['request'].user
-        return FAQs.objects.create(**validated_data, user=user)
+        return FAQs.objects.create(**validated_data, user_id=user.pk)
@@ -0,0 +1,101 @@
+from django.contrib.auth.models import Group
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from core.authentication import revoke_user_tokens
+from core.cache import bump_model_version, invalidate_product_review
+from core.models import ContractQuestion, Agreement, ProductImage, Product, User, Bank, FAQs, ProtectionFee, \
+    DisputeReason, DisputeImage
+
+# the columns whose previous value the User receivers compare against
+TRACKED_USER_FIELDS = ('photo_url', 'is_staff', 'is_superuser')
+
+
+@receiver([post_save, post_delete], sender=Bank)
+@receiver([post_save, post_delete], sender=FAQs)
+@receiver([post_save, post_delete], sender=ContractQuestion)
+@receiver([post_save, post_delete], sender=ProtectionFee)
+@receiver([post_save, post_delete], sender=DisputeReason)
+def reference_data_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_model_version(sender))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: invalidate_product_review(product_id))
+
+
+@receiver([post_save, post_delete], sender=Agreement)
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_review_changed(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_product_review(product_id))
+
+
+@receiver(pre_save, sender=User)
+def remember_user_state(sender, instance, **kwargs):
+    instance._previous_state = None
+    if instance.pk is not None:
+        instance._previous_state = sender.objects.filter(pk=instance.pk).values(*TRACKED_USER_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_credentials_changed(sender, instance, created, **kwargs):
+    # tokens carry is_staff, is_superuser and groups as claims, so any change to them (and
+    # anything else that should cut access) revokes the tokens already issued
+    previous = getattr(instance, '_previous_state', None)
+    password_changed = getattr(instance, '_password', None) is not None
+    claims_changed = previous is not None and any(
+        previous[field] != getattr(instance, field) for field in ('is_staff', 'is_superuser')
+    )
+    if not created and (password_changed or claims_changed or not instance.is_active):
+        revoke_after_commit([instance.pk])
+
+    if previous is not None and previous['photo_url'] and previous['photo_url'] != instance.photo_url.name:
+        release_file(instance.photo_url.storage, previous['photo_url'])
+
+
+def revoke_after_commit(user_ids):
+    def revoke():
+        for user_id in user_ids:
+            revoke_user_tokens(user_id)
+
+    transaction.on_commit(revoke)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # only losing a group takes access away; added groups reach the token on the next refresh
+    if action == 'post_remove':
+        revoke_after_commit(list(pk_set) if reverse else [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        # group.user_set.clear() sends no pks, so the members are read before they go
+        revoke_after_commit(list(instance.user_set.values_list('pk', flat=True)))
+    elif action == 'post_clear' and not reverse:
+        revoke_after_commit([instance.pk])
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    # the membership rows are deleted without an m2m signal
+    revoke_after_commit(list(instance.user_set.values_list('pk', flat=True)))
+
+
+def release_file(storage, name):
+    # after commit, so a rolled back delete still finds its file
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=DisputeImage)
+@receiver(post_delete, sender=User)
+def image_owner_deleted(sender, instance, **kwargs):
+    # also sent for every row removed by a Product, Dispute or User cascade
+    for field in sender._meta.get_fields():
+        if isinstance(field, models.FileField):
+            fieldfile = getattr(instance, field.name)
+            release_file(fieldfile.storage, fieldfile.name)
+
@@ -0,0 +1,100 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def split_param(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer side of ``?fields=`` / ``?expand=``.
+
+    ``fields`` keeps only the named fields. ``expand`` names which ``expandable_fields`` stay
+    embedded; the rest collapse to their primary key (or are dropped when mapped to None).
+    Without ``expand`` everything is embedded as before. Removed fields are never evaluated.
+    """
+
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if expand is not None:
+            for name, collapsed in self.expandable_fields.items():
+                if name in expand or name not in self.fields:
+                    continue
+                if collapsed is None:
+                    self.fields.pop(name)
+                else:
+                    self.fields[name] = collapsed()
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def collapsed_to_pk():
+    # PrimaryKeyRelatedField reads the *_id column, so a collapsed relation costs no query
+    return serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class SparseFieldsMixin:
+    """
+    Viewset side of ``?fields=`` / ``?expand=``: passes the requested shape to the serializer
+    and trims the queryset to it. ``field_relations`` maps a serializer field to the
+    ``(select_related, prefetch_related)`` lookups it needs; only those of fields that are
+    requested and embedded are kept, and ``?fields=`` also narrows the columns with only().
+    """
+
+    field_relations = {}
+
+    def requested_shape(self):
+        request = self.request
+        if request is None or request.method != 'GET':
+            return None, None
+        params = request.query_params
+        fields = split_param(params[FIELDS_PARAM]) if FIELDS_PARAM in params else None
+        expand = split_param(params[EXPAND_PARAM]) if EXPAND_PARAM in params else None
+        return fields, expand
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, DynamicFieldsMixin):
+            fields, expand = self.requested_shape()
+            kwargs.setdefault('fields', fields)
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def embeds(self, name, fields, expand):
+        if fields is not None and name not in fields:
+            return False
+        expandable = getattr(self.get_serializer_class(), 'expandable_fields', {})
+        return expand is None or name not in expandable or name in expand
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields, expand = self.requested_shape()
+        if (fields is None and expand is None) or self.action not in ('list', 'retrieve'):
+            return queryset
+
+        if self.field_relations:
+            queryset = queryset.select_related(None).prefetch_related(None)
+            for name, (select, prefetch) in self.field_relations.items():
+                if self.embeds(name, fields, expand):
+                    queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+
+        if fields is not None:
+            model = queryset.model
+            # the cursor and the ordering whitelist read these even when they are not returned
+            columns = {'id', 'created_at', *getattr(self, 'ordering_fields', [])}
+            for name in fields:
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    continue
+                if field.concrete:
+                    columns.add(name)
+            queryset = queryset.only(*(column for column in columns if hasattr(model, column)))
+        return queryset
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible(path='core.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    blob_prefix = 'blobs'
+
+    def get_available_name(self, name, max_length=None):
+        # the stored name is derived from the content in _save, so there is nothing to de-clash here
+        return name
+
+    def blob_name(self, digest, name):
+        _, extension = os.path.splitext(name)
+        return f'{self.blob_prefix}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+    def _save(self, name, content):
+        from core.models import MediaBlob
+
+        os.makedirs(self.location, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            # hash while streaming, so the upload is read exactly once
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(descriptor, 'wb') as destination:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    destination.write(chunk)
+                    size += len(chunk)
+
+            name = self.blob_name(digest.hexdigest(), name)
+            # take the reference before placing the file; a concurrent delete of the
+            # last reference holds the row lock until it has removed the old file
+            MediaBlob.acquire(name, size)
+
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(temporary_path, full_path)
+            temporary_path = None
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        finally:
+            if temporary_path is not None:
+                os.remove(temporary_path)
+        return name
+
+    def delete(self, name):
+        from core.models import MediaBlob
+
+        # files outside the blob tree predate this storage and are deleted as before
+        if not name.startswith(f'{self.blob_prefix}/'):
+            return self.delete_file(name)
+        MediaBlob.release(name, lambda: self.delete_file(name))
+
+    def delete_file(self, name):
+        from core.images import delete_derivatives
+
+        # the resized copies are named after the blob, so they go with its last reference
+        super().delete(name)
+        delete_derivatives(name)
+
+
+content_addressed_storage = ContentAddressedStorage()
@@ -1,3 +1,1006 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import re
+from datetime import timedelta
+from decimal import Decimal
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import brotli
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.activity import LoginActivityRecorder, login_activity
+from core.authentication import is_token_revoked, revoke_user_tokens
+from core.cache import review_cache_stats, bump_model_version, get_cached, get_model_version, get_product_review, \
+    invalidate_product_review
+from core.db_router import ReplicaRouter, current_read_alias, end_request, start_request
+from core.exports import export_response, PRODUCT_EXPORT_COLUMNS
+from core.fees import quote_fee
+from core.images import stage_uploads, persist_images, derivative_name, generate_derivatives, IMAGE_SIZES
+from core.ledger import post_entry, roll_up, current_balance
+from core.middleware import ReplicaPinMiddleware
+from core.models import User, Product, ProductImage, DisputeReason, Dispute, DisputeImage, ContractQuestion, \
+    Agreement, MediaBlob, FAQs, ProtectionFee, Bank, PayoutAccount, LedgerEntry, \
+    Transaction
+from core.renderers import ORJSONRenderer
+from core.serializers import CustomTokenObtainPairSerializer, DisputeSerializer
+from core.storage import ContentAddressedStorage
+from core.views import ProductViewSet, UserViewSet
+
+
+class ProductListQueryCountTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def create_products(self, count):
+        for index in range(Product.objects.count(), Product.objects.count() + count):
+            product = Product.objects.create(name=f'product-{index}', user=self.seller, receiver=self.buyer)
+            ProductImage.objects.create(product=product, image=f'uploads/product-{index}.jpg')
+            ProductImage.objects.create(product=product, image=f'uploads/product-{index}-side.jpg')
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('products-list'))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_products(self):
+        self.create_products(1)
+        baseline = self.count_list_queries()
+
+        self.create_products(9)
+        self.assertEqual(self.count_list_queries(), baseline)
+
+    def test_list_is_cursor_paginated(self):
+        self.create_products(5)
+        seen = []
+        url = reverse('products-list') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('id', flat=True)))
+
+    def test_updates_between_pages_neither_skip_nor_repeat_rows(self):
+        self.create_products(5)
+        response = self.client.get(reverse('products-list') + '?page_size=2')
+        seen = [item['id'] for item in response.data['results']]
+
+        # an edit to a row on a later page must not move it ahead of the cursor
+        unseen = Product.objects.exclude(id__in=seen).order_by('created_at', 'id').first()
+        unseen.description = 'edited'
+        unseen.save()
+        url = response.data['next']
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('id', flat=True)))
+
+
+class DisputeListQueryCountTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.reason = DisputeReason.objects.create(reason='Item not as described')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def create_disputes(self, count):
+        for index in range(Dispute.objects.count(), Dispute.objects.count() + count):
+            product = Product.objects.create(name=f'product-{index}', user=self.seller, receiver=self.buyer)
+            ProductImage.objects.create(product=product, image=f'uploads/product-{index}.jpg')
+            dispute = Dispute.objects.create(
+                product=product, reason=self.reason, user=self.buyer, description=f'dispute-{index}'
+            )
+            DisputeImage.objects.create(dispute=dispute, photo=f'uploads/dispute-{index}.jpg')
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('disputes-list'))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_disputes(self):
+        self.create_disputes(1)
+        baseline = self.count_list_queries()
+
+        self.create_disputes(9)
+        self.assertEqual(self.count_list_queries(), baseline)
+
+
+class ProductReviewCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['local'].clear()
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.product = Product.objects.create(name='phone', user=self.seller, receiver=self.buyer)
+        self.question = ContractQuestion.objects.create(question='Is the item as described?')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.url = reverse('products-review', args=[self.product.pk])
+
+    def test_review_is_served_from_cache_until_invalidated(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(review_cache_stats(), {'hits': 1, 'misses': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Agreement.objects.create(receiver=self.buyer, product=self.product, question=self.question, answer=True)
+        self.assertEqual(len(self.client.get(self.url).data['agreement']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ContractQuestion.objects.create(question='Was it delivered on time?')
+        self.assertEqual(len(self.client.get(self.url).data['questions']), 2)
+        self.assertEqual(review_cache_stats(), {'hits': 1, 'misses': 3})
+
+    def test_build_racing_an_invalidation_is_not_served(self):
+        def build():
+            # a write commits while the stale payload is being built
+            invalidate_product_review(self.product.pk)
+            return {'stale': True}
+
+        self.assertEqual(get_product_review(self.product.pk, build), {'stale': True})
+        self.assertEqual(get_product_review(self.product.pk, lambda: {'stale': False}), {'stale': False})
+
+
+class BulkReviewCheckTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.product = Product.objects.create(name='phone', user=self.seller, receiver=self.buyer)
+        self.questions = [ContractQuestion.objects.create(question=f'question {index}') for index in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.url = reverse('products-review-check', args=[self.product.pk])
+
+    def answers(self, *values):
+        return {'answers': [
+            {'question': question.pk, 'answer': value} for question, value in zip(self.questions, values)
+        ]}
+
+    def test_all_answers_are_written_in_one_request(self):
+        response = self.client.post(self.url, self.answers(True, True, False), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+
+        response = self.client.post(self.url, self.answers(True, False, False), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Agreement.objects.filter(product=self.product).order_by('question_id').values_list('answer', flat=True)),
+            [True, False, False],
+        )
+
+    def test_unknown_question_is_rejected(self):
+        payload = {'answers': [{'question': 0, 'answer': True}]}
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Agreement.objects.exists())
+
+
+def make_image_upload(name='photo.png', size=(1200, 900)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageIngestionTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.product = Product.objects.create(name='phone', user=self.seller, image_status='PENDING')
+
+    def test_staged_uploads_are_persisted_in_bulk(self):
+        staging_dir, staged = stage_uploads([make_image_upload('front.png'), make_image_upload('back.png')])
+        with override_settings(MEDIA_ROOT=self.media_root):
+            image_status = persist_images(ProductImage, 'image', 'product', self.product, staging_dir, staged)
+
+        self.assertEqual(image_status, 'READY')
+        self.assertEqual(ProductImage.objects.filter(product=self.product).count(), 2)
+        image = ProductImage.objects.filter(product=self.product).first()
+        with override_settings(MEDIA_ROOT=self.media_root):
+            for size, (width, height) in IMAGE_SIZES.items():
+                with Image.open(f"{self.media_root}/{derivative_name(image.image.name, size, 'webp')}") as variant:
+                    self.assertLessEqual(variant.width, width)
+                    self.assertLessEqual(variant.height, height)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_status, 'READY')
+
+    def test_invalid_upload_marks_parent_failed(self):
+        upload = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        staging_dir, staged = stage_uploads([make_image_upload(), upload])
+        with override_settings(MEDIA_ROOT=self.media_root), self.assertLogs('core.images', level='ERROR'):
+            image_status = persist_images(ProductImage, 'image', 'product', self.product, staging_dir, staged)
+
+        self.assertEqual(image_status, 'FAILED')
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_uploads_lost_by_a_restart_are_failed_and_cleaned_up(self):
+        fresh = Product.objects.create(name='tablet', user=self.seller, image_status='PENDING')
+        Product.objects.filter(pk=self.product.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+        with override_settings(IMAGE_INGEST_STAGING_DIR=self.media_root):
+            staging_dir, _ = stage_uploads([make_image_upload()])
+            two_hours_ago = time.time() - 2 * 60 * 60
+            os.utime(staging_dir, (two_hours_ago, two_hours_ago))
+            call_command('recover_image_ingestion', max_age=60, stdout=io.StringIO())
+
+        self.assertFalse(os.path.exists(staging_dir))
+        self.product.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((self.product.image_status, fresh.image_status), ('FAILED', 'PENDING'))
+
+    def test_deleting_the_last_reference_removes_the_blob(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            images = []
+            for name in ('front.png', 'copy.png'):
+                image = ProductImage(product=self.product)
+                image.image.save(name, make_image_upload(name))
+                images.append(image)
+            name = images[0].image.name
+            generate_derivatives(images[0].image)
+            thumb = derivative_name(name, 'thumb', 'webp')
+            self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                images[0].delete()
+            self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+            self.assertTrue(default_storage.exists(name))
+
+            # the cascade from the product releases the last reference
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.delete()
+            self.assertFalse(MediaBlob.objects.exists())
+            self.assertFalse(default_storage.exists(name))
+            self.assertFalse(default_storage.exists(thumb))
+
+    def test_replacing_a_photo_releases_the_old_one(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            self.seller.photo_url.save('me.png', make_image_upload('me.png', size=(40, 40)))
+            old = self.seller.photo_url.name
+            with self.captureOnCommitCallbacks(execute=True):
+                self.seller.photo_url.save('new.png', make_image_upload('new.png', size=(50, 50)))
+            self.assertFalse(MediaBlob.objects.filter(name=old).exists())
+            self.assertTrue(MediaBlob.objects.filter(name=self.seller.photo_url.name).exists())
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.storage.save('uploads/front.png', make_image_upload('front.png'))
+        second = self.storage.save('uploads/copy.png', make_image_upload('copy.png'))
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('blobs/'))
+        self.assertEqual(MediaBlob.objects.get(name=first).refcount, 2)
+
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.storage.delete(second)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+class MediaServingTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        with open(f'{self.media_root}/sample.txt', 'wb') as file:
+            file.write(b'0123456789')
+        self.url = '/media/sample.txt'
+
+    def test_conditional_request_returns_not_modified(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+            etag, cache_control = response['ETag'], response['Cache-Control']
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], cache_control)
+
+    def test_byte_ranges(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+            self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+            response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_accel_redirect_hands_off_to_proxy(self):
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_SERVE_MODE='accel'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/sample.txt')
+        self.assertEqual(response.content, b'')
+
+
+class StatelessJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(
+            username='staff', email='staff@example.com', password='secret', is_staff=True
+        )
+        self.client = APIClient()
+        self.addCleanup(login_activity.flush)
+
+    def authenticate(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'staff', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+    def test_permission_checks_need_no_queries(self):
+        self.authenticate()
+        # the first request reads the user's revocation row, the next ones answer it from memory
+        self.client.get(reverse('products-review-cache-stats'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products-review-cache-stats'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivated_user_tokens_are_revoked(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_active = False
+            self.admin.save()
+
+        response = self.client.get(reverse('products-review-cache-stats'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_losing_staff_revokes_admin_claims(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_staff = False
+            self.admin.save()
+        self.assertEqual(self.client.get(reverse('products-review-cache-stats')).status_code, 401)
+
+    def test_clearing_or_deleting_a_group_revokes_its_members(self):
+        group = Group.objects.create(name='admin')
+        group.user_set.add(self.admin)
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            group.user_set.clear()
+        self.assertEqual(self.client.get(reverse('products-review-cache-stats')).status_code, 401)
+
+        group.user_set.add(self.admin)
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            group.delete()
+        self.assertEqual(self.client.get(reverse('products-review-cache-stats')).status_code, 401)
+
+    def test_revocations_survive_cache_culling(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_active = False
+            self.admin.save()
+        caches['local'].clear()
+        # well past the shared cache's MAX_ENTRIES, so its cull has run
+        for index in range(400):
+            cache.set(f'filler-{index}', index)
+        self.assertEqual(self.client.get(reverse('products-review-cache-stats')).status_code, 401)
+
+    def test_revocation_checks_are_served_from_process_memory(self):
+        token = {'user_id': self.admin.pk, 'iat': int(time.time())}
+        self.assertFalse(is_token_revoked(token))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_token_revoked(token))
+        revoke_user_tokens(self.admin.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_token_revoked({'user_id': self.admin.pk, 'iat': 0}))
+
+
+class LoginActivityRecorderTest(TestCase):
+    def test_logins_are_coalesced_into_one_bulk_update(self):
+        users = [
+            User.objects.create_user(username=f'user-{index}', email=f'user-{index}@example.com', password='secret')
+            for index in range(3)
+        ]
+        recorder = LoginActivityRecorder(flush_interval=60, max_pending=100)
+        for user in users + users:
+            recorder.record(user.pk)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(recorder.flush(), 3)
+        self.assertFalse(User.objects.filter(last_login__isnull=True).exists())
+
+
+class CountryListTest(TestCase):
+    def test_list_is_precompressed_and_cacheable(self):
+        response = self.client.get(reverse('country_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        countries = json.loads(gzip.decompress(response.content))
+        self.assertIn({'value': 'NG', 'label': 'Nigeria'}, countries)
+
+        response = self.client.get(
+            reverse('country_list'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_brotli_is_preferred_when_accepted(self):
+        response = self.client.get(reverse('country_list'), HTTP_ACCEPT_ENCODING='br;q=1, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn({'value': 'NG', 'label': 'Nigeria'}, json.loads(brotli.decompress(response.content)))
+
+    def test_q_zero_refuses_an_encoding(self):
+        response = self.client.get(reverse('country_list'), HTTP_ACCEPT_ENCODING='br;q=0, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(reverse('country_list'), HTTP_ACCEPT_ENCODING='gzip;q=0, *;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIsInstance(json.loads(response.content), list)
+
+
+class CachedReferenceDataTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        FAQs.objects.create(question='How do I pay?', answer='With a card.')
+        self.url = reverse('faqs-list')
+
+    def test_list_is_cached_until_the_model_changes(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.json(), second.json())
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQs.objects.create(question='Can I get a refund?', answer='Open a dispute.')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+
+class ProtectionFeeQuoteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        ProtectionFee.objects.create(name='service', fee=Decimal('100.00'))
+        ProtectionFee.objects.create(name='escrow', fee=Decimal('1.5'), is_percent=True)
+
+    def test_quotes_are_priced_from_the_schedule(self):
+        response = self.client.post(
+            reverse('protection-fees-quote'), {'amounts': ['1000.00', '333.33', '0']}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([quote['fee'] for quote in response.data['quotes']], ['115.00', '105.00', '100.00'])
+
+    def test_schedule_reloads_when_fees_change(self):
+        self.assertEqual(quote_fee(Decimal('1000')), Decimal('115.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProtectionFee.objects.filter(name='service').delete()
+        self.assertEqual(quote_fee(Decimal('1000')), Decimal('15.00'))
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='secret', is_staff=True
+        )
+        bank = Bank.objects.create(name='bank')
+        self.account = PayoutAccount.objects.create(
+            account_number=1234567890, account_name='staff', bank=bank, balance=Decimal('10.00')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def post(self, amount, key):
+        return self.client.post(
+            reverse('payout-ledger', args=[self.account.pk]),
+            {'amount': amount, 'idempotency_key': key},
+            format='json',
+        )
+
+    def test_postings_are_idempotent(self):
+        self.assertEqual(self.post('25.00', 'payment-1').status_code, 201)
+        replay = self.post('25.00', 'payment-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(LedgerEntry.objects.count(), 1)
+
+        self.post('-5.50', 'payout-1')
+        response = self.client.get(reverse('payout-detail', args=[self.account.pk]))
+        self.assertEqual(response.data['balance'], '29.50')
+
+    def test_replaying_a_key_with_a_different_posting_conflicts(self):
+        self.assertEqual(self.post('25.00', 'payment-1').status_code, 201)
+        self.assertEqual(self.post('30.00', 'payment-1').status_code, 409)
+        self.assertEqual(LedgerEntry.objects.get().amount, Decimal('25.00'))
+
+    def test_balance_filter_and_ordering_use_the_rolled_up_balance(self):
+        other = PayoutAccount.objects.create(
+            account_number=987654321, account_name='other', bank=self.account.bank, balance=Decimal('20.00')
+        )
+        post_entry(self.account.pk, Decimal('15.00'), 'payment-4')
+        # the pending posting only counts once it is rolled up
+        response = self.client.get(reverse('payout-list'), {'balance_min': '21'})
+        self.assertEqual(response.data['results'], [])
+
+        roll_up(self.account.pk)
+        response = self.client.get(reverse('payout-list'), {'ordering': '-balance'})
+        self.assertEqual([account['id'] for account in response.data['results']], [self.account.pk, other.pk])
+        response = self.client.get(reverse('payout-list'), {'balance_min': '21'})
+        self.assertEqual([account['id'] for account in response.data['results']], [self.account.pk])
+
+    def test_ledger_is_visible_to_its_owner_and_staff_only(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com')
+        PayoutAccount.objects.filter(pk=self.account.pk).update(user=owner)
+        url = reverse('payout-ledger', args=[self.account.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.client.force_authenticate(owner)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_authenticate(User.objects.create_user(username='other', email='other@example.com'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_rollup_folds_entries_into_balance(self):
+        post_entry(self.account.pk, Decimal('7.25'), 'payment-2')
+        post_entry(self.account.pk, Decimal('2.75'), 'payment-3')
+
+        self.assertEqual(roll_up(self.account.pk), 2)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('20.00'))
+        self.assertEqual(current_balance(self.account), Decimal('20.00'))
+        self.assertEqual(roll_up(self.account.pk), 0)
+
+
+class EscrowTransactionTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.account = PayoutAccount.objects.create(
+            user=self.seller, account_number=1234567890, account_name='seller', bank=Bank.objects.create(name='bank')
+        )
+        self.product = Product.objects.create(
+            name='phone', user=self.seller, receiver=self.buyer, amount=Decimal('500.00'), fee=Decimal('10.00')
+        )
+        self.client = APIClient()
+
+    def act(self, user, escrow_id, action_name, **data):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse(f'transactions-{action_name}', args=[escrow_id]), data, format='json')
+
+    def test_full_lifecycle_credits_the_seller_once(self):
+        self.client.force_authenticate(self.buyer)
+        escrow_id = self.client.post(reverse('transactions-list'), {'product': self.product.pk}, format='json').data['id']
+
+        self.assertEqual(self.act(self.buyer, escrow_id, 'fund').data['state'], 'FUNDED')
+        self.assertEqual(self.act(self.buyer, escrow_id, 'deliver').status_code, 403)
+        self.assertEqual(self.act(self.seller, escrow_id, 'deliver').data['state'], 'DELIVERED')
+        response = self.act(self.buyer, escrow_id, 'release')
+        self.assertEqual(response.data['state'], 'RELEASED')
+        self.assertEqual(response.data['version'], 4)
+        self.assertEqual(self.act(self.buyer, escrow_id, 'release').status_code, 400)
+
+        self.assertEqual(current_balance(self.account), Decimal('500.00'))
+        self.assertEqual(Transaction.objects.filter(state='RELEASED').count(), 1)
+
+    def test_stale_version_is_rejected(self):
+        escrow = Transaction.objects.create(product=self.product, buyer=self.buyer, seller=self.seller)
+        self.assertEqual(self.act(self.buyer, escrow.pk, 'fund', version=1).status_code, 200)
+        # a second client still holding version 1
+        response = self.act(self.buyer, escrow.pk, 'dispute', version=1)
+        self.assertEqual(response.status_code, 409)
+        escrow.refresh_from_db()
+        self.assertEqual((escrow.state, escrow.version), ('FUNDED', 2))
+
+
+class QueryPlanTest(TestCase):
+    FULL_SCAN = r'Seq Scan|\bSCAN core_'
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # an empty test table is cheapest to scan; make the planner show what it would use at scale
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def test_dispute_queue_uses_status_index(self):
+        plan = self.explain(Dispute.objects.filter(status='PENDING').order_by('-created_at', '-id'))
+        self.assertNotRegex(plan, self.FULL_SCAN)
+        self.assertRegex(plan, r'dispute_(status_created|pending)_idx')
+
+    def explain_sql(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(prefix + sql)
+            return '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+
+    def test_natural_key_lookup_uses_both_unique_indexes(self):
+        # the SQL the manager actually runs, so a change to get_by_natural_key is caught here
+        with CaptureQueriesContext(connection) as context, self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key('someone')
+        self.assertEqual(len(context.captured_queries), 1)
+        plan = self.explain_sql(context.captured_queries[0]['sql'])
+        self.assertNotRegex(plan, self.FULL_SCAN)
+        self.assertGreaterEqual(len(re.findall(r'(?i)index', plan)), 2)
+
+    def test_natural_key_matches_username_or_email(self):
+        user = User.objects.create_user(username='someone', email='someone@example.com', password='secret')
+        self.assertEqual(User.objects.get_by_natural_key('someone'), user)
+        self.assertEqual(User.objects.get_by_natural_key('someone@example.com'), user)
+        with self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key('nobody')
+
+
+class DatabaseHealthTest(TestCase):
+    def test_reports_connection_mode_to_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='member', email='member@example.com'))
+        self.assertEqual(client.get(reverse('database_health')).status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(
+            username='staff', email='staff@example.com', is_staff=True
+        ))
+        response = client.get(reverse('database_health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['vendor'], connection.vendor)
+        self.assertEqual(response.data['pooled'], response.data['pool'] is not None)
+
+
+class ReplicaRoutingTest(TestCase):
+    def route(self, view, method='GET', cookies=None, write=False):
+        request = RequestFactory().generic(method, '/api/products/')
+        request.COOKIES.update(cookies or {})
+        seen = {}
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            if write:
+                ReplicaRouter().db_for_write(Product)
+            seen['alias'] = current_read_alias()
+            return HttpResponse()
+
+        middleware = ReplicaPinMiddleware(get_response)
+        response = middleware(request)
+        return seen['alias'], response.cookies.get(settings.REPLICA_PIN_COOKIE)
+
+    def test_safe_reads_of_opted_in_views_use_the_replica(self):
+        self.assertEqual(self.route(ProductViewSet.as_view({'get': 'list'})), (settings.REPLICA_DATABASE, None))
+        self.assertEqual(self.route(UserViewSet.as_view({'get': 'list'})), (None, None))
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        view = ProductViewSet.as_view({'get': 'list', 'post': 'create'})
+        alias, cookie = self.route(view, write=True)
+        self.assertIsNone(alias)
+        self.assertEqual(cookie['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        self.assertIsNotNone(self.route(view, method='POST')[1])
+        self.assertIsNone(self.route(view, cookies={settings.REPLICA_PIN_COOKIE: cookie.value})[0])
+        # an expired pin no longer applies
+        self.assertEqual(
+            self.route(view, cookies={settings.REPLICA_PIN_COOKIE: '1'})[0], settings.REPLICA_DATABASE
+        )
+
+    def test_cache_fills_after_a_bump_read_the_primary(self):
+        aliases = []
+
+        def build():
+            aliases.append(current_read_alias())
+            return ['fresh']
+
+        state, token = start_request()
+        state['replica'] = True
+        try:
+            bump_model_version(Bank)
+            key = f'list:core.bank:{get_model_version(Bank)}:replica-test'
+            self.assertEqual(get_cached(key, build, 60), ['fresh'])
+            # a lagging replica never gets the chance to store stale rows under the new version
+            self.assertEqual(aliases, [None])
+            self.assertEqual(current_read_alias(), settings.REPLICA_DATABASE)
+        finally:
+            end_request(token)
+
+
+@override_settings(DEFAULT_HOST='http://testserver')
+class AsyncReadViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['local'].clear()
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        for index in range(5):
+            product = Product.objects.create(name=f'product-{index}', user=self.seller, receiver=self.buyer)
+            ProductImage.objects.create(product=product, image=f'uploads/product-{index}.jpg')
+        self.product = product
+        token = CustomTokenObtainPairSerializer.get_token(self.seller).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    async def test_requires_a_token(self):
+        response = await self.async_client.get(reverse('async-products-list'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_product_list_matches_sync_endpoint(self):
+        results, url = [], reverse('async-products-list') + '?page_size=2'
+        while url:
+            response = await self.async_client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.json()['results'])
+            url = response.json()['next']
+
+        sync_client = APIClient()
+        sync_client.force_authenticate(self.seller)
+        sync_response = await sync_to_async(sync_client.get)(reverse('products-list') + '?page_size=10')
+        self.assertEqual(results, json.loads(sync_response.content)['results'])
+
+    async def test_filtered_sparse_list_matches_sync_endpoint(self):
+        await Product.objects.filter(name__in=['product-1', 'product-3']).aupdate(amount=Decimal('500.00'))
+        params = {'amount_min': '100', 'fields': 'id,name,amount', 'page_size': 10}
+        response = await self.async_client.get(reverse('async-products-list'), params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        sync_client = APIClient()
+        sync_client.force_authenticate(self.seller)
+        sync_response = await sync_to_async(sync_client.get)(reverse('products-list'), params)
+        self.assertEqual(response.json()['results'], json.loads(sync_response.content)['results'])
+        self.assertEqual([product['name'] for product in response.json()['results']], ['product-3', 'product-1'])
+
+        response = await self.async_client.get(reverse('async-products-list'), {'q': 'phone'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_detail_and_review(self):
+        response = await self.async_client.get(
+            reverse('async-products-detail', args=[self.product.pk]), headers=self.headers
+        )
+        self.assertEqual(response.json()['name'], 'product-4')
+
+        review_url = reverse('async-products-review', args=[self.product.pk])
+        first = await self.async_client.get(review_url, headers=self.headers)
+        second = await self.async_client.get(review_url, headers=self.headers)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(review_cache_stats(), {'hits': 1, 'misses': 1})
+
+        missing = await self.async_client.get(reverse('async-products-review', args=[0]), headers=self.headers)
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_dispute_status_is_validated_like_the_sync_filter(self):
+        url = reverse('async-disputes-list')
+        response = await self.async_client.get(url, {'status': 'OPEN'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+        response = await self.async_client.get(url, {'status': 'PENDING'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['local'].clear()
+        self.user = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        for name in ('Red phone', 'Blue phone case', 'Garden chair'):
+            Product.objects.create(name=name, description=f'{name} in good condition', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_filters_and_pages_by_offset(self):
+        response = self.client.get(reverse('products-list'), {'q': 'phone', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIn('phone', response.data['results'][0]['name'])
+
+    def test_without_query_the_cursor_pagination_is_kept(self):
+        response = self.client.get(reverse('products-list'))
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def cached_faq_lists(self):
+        return len([key for key in caches['local']._cache if 'list:core.faqs:' in key])
+
+    def test_faqs_are_searchable(self):
+        FAQs.objects.create(question='How do refunds work?', answer='Funds return to the buyer.')
+        FAQs.objects.create(question='What is escrow?', answer='We hold the payment.')
+        response = self.client.get(reverse('faqs-list'), {'q': 'refunds'})
+        self.assertEqual(self.cached_faq_lists(), 0)
+        # the same bare list as without a query, and not cached per query string
+        self.assertEqual([faq['question'] for faq in response.data], ['How do refunds work?'])
+        self.assertEqual(len(self.client.get(reverse('faqs-list')).data), 2)
+        self.assertEqual(self.cached_faq_lists(), 1)
+
+
+class FilteringTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        for index, amount in enumerate(['50.00', '150.00', '250.00']):
+            Product.objects.create(name=f'product-{index}', amount=Decimal(amount), user=self.seller)
+        Product.objects.create(name='bought', amount=Decimal('100.00'), receiver=self.buyer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def names(self, **params):
+        response = self.client.get(reverse('products-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_product_ranges_and_parties(self):
+        self.assertEqual(sorted(self.names(amount_min='100', amount_max='200')), ['bought', 'product-1'])
+        self.assertEqual(self.names(receiver=self.buyer.pk), ['bought'])
+        self.assertEqual(len(self.names(user=self.seller.pk)), 3)
+
+    def test_ordering_is_limited_to_indexed_columns(self):
+        self.assertEqual(self.names(ordering='-amount')[:2], ['product-2', 'product-1'])
+        # not whitelisted, so the default created_at cursor order applies
+        self.assertEqual(self.names(ordering='description')[0], 'bought')
+
+    def test_users_filter_by_group(self):
+        Group.objects.create(name='support').user_set.add(self.buyer)
+        response = self.client.get(reverse('users-list'), {'group': 'support'})
+        self.assertEqual([user['username'] for user in response.data['results']], ['buyer'])
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.product = Product.objects.create(
+            name='phone', description='a long description', user=self.seller, receiver=self.buyer
+        )
+        ProductImage.objects.create(product=self.product, image='uploads/phone.jpg')
+        reason = DisputeReason.objects.create(reason='Not as described')
+        Dispute.objects.create(user=self.buyer, product=self.product, reason=reason, description='broken')
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def test_fields_limits_output_columns_and_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('products-list'), {'fields': 'id,name'})
+        self.assertEqual(response.data['results'], [{'id': self.product.pk, 'name': 'phone'}])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('description', context.captured_queries[0]['sql'])
+
+    def test_unexpanded_relations_collapse_to_ids(self):
+        response = self.client.get(reverse('products-list'), {'expand': 'receiver'})
+        product = response.data['results'][0]
+        self.assertEqual(product['user'], self.seller.pk)
+        self.assertEqual(product['receiver']['username'], 'buyer')
+        self.assertNotIn('images', product)
+
+    def test_dispute_without_embedded_product(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('disputes-list'), {'fields': 'id,product,status', 'expand': ''})
+        self.assertEqual(response.data['results'][0], {
+            'id': Dispute.objects.get().pk, 'product': self.product.pk, 'status': 'PENDING'
+        })
+
+    def test_default_shape_is_unchanged(self):
+        product = self.client.get(reverse('products-list')).data['results'][0]
+        self.assertEqual(product['user']['username'], 'seller')
+        self.assertEqual(len(product['images']), 1)
+
+
+class ORJSONRendererTest(TestCase):
+    @override_settings(DEFAULT_HOST='http://testserver')
+    def test_matches_the_stdlib_renderer(self):
+        seller = User.objects.create_user(username='seller', email='seller@example.com')
+        product = Product.objects.create(
+            name='café table', description='line one\nline "two"', amount=Decimal('1234567.89'),
+            fee=Decimal('0.10'), user=seller,
+        )
+        ProductImage.objects.create(product=product, image='uploads/table.jpg')
+        reason = DisputeReason.objects.create(reason='Not as described')
+        Dispute.objects.create(user=seller, product=product, reason=reason, description='broken leg')
+        data = DisputeSerializer(Dispute.objects.all(), many=True).data
+
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_staff_can_stream_the_whole_list(self):
+        staff = User.objects.create_user(username='staff', email='staff@example.com', is_staff=True)
+        for index in range(5):
+            Product.objects.create(name=f'product-{index}', amount=Decimal('10.50'), user=staff)
+        client = APIClient()
+        client.force_authenticate(staff)
+
+        with self.settings(JSON_STREAM_CHUNK_SIZE=2):
+            response = client.get(reverse('products-list'), {'stream': 'true', 'fields': 'id,amount'})
+            products = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(products), 5)
+        self.assertEqual(products[0]['amount'], '10.50')
+
+    def test_streamed_list_reads_from_the_alias_chosen_in_the_view(self):
+        def db_for_read(router, model, **hints):
+            # only a query routed while the request is still live reaches a real database;
+            # prefetches follow their instances' alias, as they do with the real router
+            if current_read_alias():
+                return 'default'
+            return None if 'instance' in hints else 'gone'
+
+        staff = User.objects.create_user(username='staff', email='staff@example.com', is_staff=True)
+        Product.objects.create(name='phone', user=staff)
+        client = APIClient()
+        client.force_authenticate(staff)
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            response = client.get(reverse('products-list'), {'stream': 'true'})
+            products = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([product['name'] for product in products], ['phone'])
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', email='staff@example.com', is_staff=True)
+        for index, amount in enumerate(['50.00', '150.00', '250.00']):
+            Product.objects.create(name=f'product-{index}', amount=Decimal(amount), user=self.staff)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_csv_export_honours_the_list_filters(self):
+        with self.settings(EXPORT_CHUNK_SIZE=1):
+            response = self.client.get(reverse('products-export'), {'amount_min': '100', 'ordering': 'amount'},
+                                       HTTP_ACCEPT='text/csv')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        self.assertEqual(lines[0], 'id,name,description,amount,fee,seller,receiver,created_at')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['product-1', 'product-2'])
+
+    def test_ndjson_export_keeps_amounts_exact(self):
+        response = self.client.get(reverse('products-export'), {'output': 'ndjson', 'amount_max': '100'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(records, [records[0]])
+        self.assertEqual((records[0]['name'], records[0]['amount'], records[0]['seller']), ('product-0', '50.00', 'staff'))
+
+    def test_export_is_staff_only(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(reverse('disputes-export')).status_code, 403)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get(reverse('disputes-export'), {'output': 'xml'}).status_code, 400)
+
+    def test_csv_cells_cannot_start_a_formula(self):
+        Product.objects.create(name='=HYPERLINK("http://example.com")', description='@SUM(A1)', user=self.staff)
+        response = self.client.get(reverse('products-export'), {'amount_max': '0'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[1][1:3], ['\'=HYPERLINK("http://example.com")', "'@SUM(A1)"])
+
+    def test_streamed_body_reads_from_the_alias_chosen_in_the_view(self):
+        def db_for_read(router, model, **hints):
+            # only a query routed while the request is still live reaches a real database
+            return 'default' if current_read_alias() else 'gone'
+
+        state, token = start_request()
+        state['replica'] = True
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            try:
+                response = export_response(Product.objects.all(), PRODUCT_EXPORT_COLUMNS, 'csv')
+            finally:
+                end_request(token)
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
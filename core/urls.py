@@ -1,9 +1,10 @@
 from django.urls import re_path, path
 from rest_framework import routers
 
+from core.async_views import product_list, product_detail, product_review, dispute_list
 from core.views import CountryListView, BankViewSet, PayoutAccountViewSet, CustomTokenObtainPairView, ProductViewSet, \
     ContractViewSet, DisputeViewSet, ProtectionFeeViewSet, FAQsViewSet, CustomTokenVerifyView, CustomTokenRefreshView, \
-    UserViewSet
+    UserViewSet, TransactionViewSet, DatabaseHealthView
 
 router = routers.DefaultRouter()
 router.register(r'banks', BankViewSet, basename='banks')
@@ -14,12 +15,19 @@ router.register(r'disputes', DisputeViewSet, basename='disputes')
 router.register(r'protection-fees', ProtectionFeeViewSet, basename='protection-fees')
 router.register(r'faqs', FAQsViewSet, basename='faqs')
 router.register('users', UserViewSet, basename='users')
+router.register(r'transactions', TransactionViewSet, basename='transactions')
 
 urlpatterns = [
     path('auth/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
     path('auth/token/verify/', CustomTokenVerifyView.as_view(), name='token_verify'),
     re_path('countries/', CountryListView.as_view(), name='country_list'),
+    path('health/db/', DatabaseHealthView.as_view(), name='database_health'),
+    # async (ASGI-native) versions of the hottest read endpoints
+    path('async/products/', product_list, name='async-products-list'),
+    path('async/products/<int:pk>/', product_detail, name='async-products-detail'),
+    path('async/products/<int:pk>/review/', product_review, name='async-products-review'),
+    path('async/disputes/', dispute_list, name='async-disputes-list'),
 ]
 
 urlpatterns += router.urls
@@ -1,15 +1,22 @@
 from django.contrib.auth.models import UserManager
-from django.db.models import Q
 import random
 import string
 
 
 class CustomUserManager(UserManager):
     def get_by_natural_key(self, username):
-        return self.get(
-            Q(**{self.model.USERNAME_FIELD: username}) |
-            Q(**{self.model.EMAIL_FIELD: username})
-        )
+        # an OR across two columns generally can't use either unique index, so each
+        # column gets its own indexed lookup and the two are combined with UNION
+        by_username = self.filter(**{self.model.USERNAME_FIELD: username})
+        by_email = self.filter(**{self.model.EMAIL_FIELD: username})
+        users = list(by_username.union(by_email)[:2])
+        if not users:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching query does not exist.')
+        if len(users) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get_by_natural_key() returned more than one {self.model._meta.object_name}'
+            )
+        return users[0]
 
 
 def generate_random_string(length=8):
@@ -1,15 +1,30 @@
 from django_filters.rest_framework import DjangoFilterBackend
-from django.contrib.auth import get_user_model
-from django.utils.timezone import now
-from django_countries import countries
+from django.db.models import Q
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import translation
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenVerifyView, TokenRefreshView
 
+from core.authentication import is_admin
+from core.cache import get_product_review, review_cache_stats, CachedListMixin, cached_list_response
+from core.countries import pick_country_variant, CACHE_CONTROL
+from core.db import database_health
+from core.exports import (
+    ExportMixin, DISPUTE_EXPORT_COLUMNS, PAYOUT_ACCOUNT_EXPORT_COLUMNS, PRODUCT_EXPORT_COLUMNS,
+)
+from core.escrow import apply_transition, can_act, InvalidTransition, StaleTransaction
+from core.fees import quote_fees
+from core.filters import ProductFilter, UserFilter, PayoutAccountFilter, PayoutAccountOrderingFilter
+from core.images import schedule_derivatives
+from core.ledger import post_entry, with_ledger_balance
 from core.models import (
     Bank,
     PayoutAccount,
@@ -19,6 +34,8 @@ from core.models import (
     DisputeReason,
     ProtectionFee,
     FAQs,
+    LedgerEntry,
+    Transaction,
     User
 )
 from core.serializers import (
@@ -27,8 +44,13 @@ from core.serializers import (
     PayoutAccountSerializer, CustomTokenObtainPairSerializer, ProductSerializer, ContractQuestionSerializer,
     DisputeSerializer, DisputeReasonSerializer, ProtectionFeeSerializer, AgreementSerializer, ProductReviewSerializer,
     FAQsSerializer, CustomTokenVerifySerializer, CustomTokenRefreshSerializer, DisputeStatusSerializer, UserSerializer,
-    UserNotificationSettingsSerializer, UserProfilePhotoSerializer
+    UserNotificationSettingsSerializer, UserProfilePhotoSerializer, AgreementBulkSerializer, FeeQuoteSerializer,
+    LedgerEntrySerializer, TransactionSerializer, TransactionTransitionSerializer
 )
+from core.pagination import CreatedAtCursorPagination
+from core.renderers import ORJSONParser, StreamingListMixin
+from core.search import FullTextSearchFilter, SearchMixin
+from core.sparse import SparseFieldsMixin
 
 import logging
 
@@ -38,16 +60,6 @@ logger = logging.getLogger(__name__)
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
-    def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        user = request.user
-        logger.info(f"User: {user}, Authenticated: {user.is_authenticated}")
-        if user and user.is_authenticated:
-            UserModel = get_user_model()
-            UserModel.objects.filter(pk=user.pk).update(last_login=now())
-            logger.info(f"Updated last_login for User ID: {user.pk}")
-        return response
-
 
 class CustomTokenVerifyView(TokenVerifyView):
     serializer_class = CustomTokenVerifySerializer
@@ -57,22 +69,47 @@ class CustomTokenRefreshView(TokenRefreshView):
     serializer_class = CustomTokenRefreshSerializer
 
 
+class DatabaseHealthView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            return Response(database_health(), status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.exception('Database health check failed')
+            return Response({"success": False, 'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
 class CountryListView(APIView):
     serializer_class = CountrySerializer
 
     def get(self, request):
         try:
-            countries_list = [{'value': code, 'label': name} for code, name in countries]
-            serializer = CountrySerializer(countries_list, many=True)
-            return Response(serializer.data)
+            language = translation.get_language_from_request(request)
+            encoding, body, etag = pick_country_variant(request, language)
+
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(body, content_type='application/json')
+                if encoding:
+                    response['Content-Encoding'] = encoding
+            response['ETag'] = etag
+            response['Cache-Control'] = CACHE_CONTROL
+            patch_vary_headers(response, ('Accept-Encoding', 'Accept-Language'))
+            return response
         except Exception as e:
             return Response({"success": False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     http_method_names = ['get', 'post', 'put']
+    pagination_class = CreatedAtCursorPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = UserFilter
+    # only indexed columns, so ?ordering= can never force a full sort
+    ordering_fields = ['created_at', 'date_joined']
 
     def get_permissions(self):
         # Set permission for specific actions
@@ -93,7 +130,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='admin').exists():
+        if is_admin(user):
             return User.objects.all()
         return User.objects.exclude(is_superuser=True).all()
 
@@ -123,34 +160,103 @@ class UserViewSet(viewsets.ModelViewSet):
     def set_profile_photo(self, request, pk=None):
         data = request.data
         user = User.objects.get(pk=pk)
-        serializer = UserProfilePhotoSerializer(user, data=data)
+        serializer = UserProfilePhotoSerializer(user, data=data, context={'request': request})
         try:
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            schedule_derivatives(user.photo_url)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BankViewSet(viewsets.ModelViewSet):
+class BankViewSet(SparseFieldsMixin, CachedListMixin, viewsets.ModelViewSet):
     serializer_class = BankSerializer
     queryset = Bank.objects.all()
     permission_classes = [IsAuthenticated]
     http_methods_names = ['get', 'post', 'put']
+    replica_reads = True
+    pagination_class = CreatedAtCursorPagination
 
 
-class PayoutAccountViewSet(viewsets.ModelViewSet):
+class PayoutAccountViewSet(ExportMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = PayoutAccountSerializer
-    queryset = PayoutAccount.objects.all()
+    queryset = with_ledger_balance(PayoutAccount.objects.all())
     http_method_names = ['get', 'post', 'put']
+    pagination_class = CreatedAtCursorPagination
+    filter_backends = [DjangoFilterBackend, PayoutAccountOrderingFilter]
+    filterset_class = PayoutAccountFilter
+    # balance sorts on the indexed, rolled-up column (payout_balance_idx), not the ledger_balance shown
+    ordering_fields = ['created_at', 'balance']
+    export_columns = PAYOUT_ACCOUNT_EXPORT_COLUMNS
 
+    @action(
+        detail=True,
+        methods=["GET"],
+        url_path='ledger',
+        url_name='ledger',
+        serializer_class=LedgerEntrySerializer,
+        permission_classes=[IsAuthenticated],
+    )
+    def ledger(self, request, pk=None):
+        accounts = PayoutAccount.objects.all()
+        if not request.user.is_staff:
+            # other users' ledgers are not even acknowledged to exist
+            accounts = accounts.filter(user_id=request.user.pk)
+        account = get_object_or_404(accounts, pk=pk)
+        entries = LedgerEntry.objects.filter(account=account)
+        page = self.paginate_queryset(entries)
+        return self.get_paginated_response(LedgerEntrySerializer(page, many=True).data)
+
+    @ledger.mapping.post
+    def post_ledger_entry(self, request, pk=None):
+        if not request.user.is_staff:
+            return Response({"success": False, 'error': 'Only staff can post ledger entries'},
+                            status=status.HTTP_403_FORBIDDEN)
+        account = get_object_or_404(PayoutAccount, pk=pk)
+        serializer = LedgerEntrySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-class ProductViewSet(viewsets.ModelViewSet):
+        entry, created = post_entry(account.pk, **serializer.validated_data)
+        if entry.account_id != account.pk:
+            return Response({"success": False, 'error': 'Idempotency key already used for another account'},
+                            status=status.HTTP_409_CONFLICT)
+        if not created and (
+            entry.amount != serializer.validated_data['amount']
+            or entry.description != serializer.validated_data.get('description', '')
+        ):
+            return Response({"success": False, 'error': 'Idempotency key already used for a different posting'},
+                            status=status.HTTP_409_CONFLICT)
+        # replaying the same key returns the original posting
+        return Response(LedgerEntrySerializer(entry).data,
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class ProductViewSet(ExportMixin, StreamingListMixin, SparseFieldsMixin, SearchMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('user', 'receiver').prefetch_related(
+        'productimage_set',
+        'user__groups',
+        'receiver__groups',
+    )
     http_method_names = ['get', 'post', 'put']
-    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    parser_classes = (MultiPartParser, FormParser, ORJSONParser)
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    lookup_value_regex = r'\d+'
+    replica_reads = True
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
+    filterset_class = ProductFilter
+    ordering_fields = ['created_at', 'amount', 'fee']
+    field_relations = {
+        'user': (['user'], ['user__groups']),
+        'receiver': (['receiver'], ['receiver__groups']),
+        'images': ([], ['productimage_set']),
+    }
+    search_fields = ('name', 'description')
+    search_trigram_field = 'name'
+    export_columns = PRODUCT_EXPORT_COLUMNS
 
     @action(
         methods=['get'],
@@ -160,12 +266,21 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer_class=ProductReviewSerializer
     )
     def review(self, request, pk=None):
-        product = Product.objects.get(pk=pk)
-        serializer = ProductReviewSerializer(product)
-        try:
-            return Response(serializer.data)
-        except:
-            return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        def build_review():
+            queryset = Product.objects.prefetch_related('productimage_set', 'agreement_set')
+            return ProductReviewSerializer(get_object_or_404(queryset, pk=pk)).data
+
+        return Response(get_product_review(pk, build_review))
+
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='review-cache-stats',
+        url_name='review-cache-stats',
+        permission_classes=[IsAdminUser],
+    )
+    def review_stats(self, request):
+        return Response(review_cache_stats())
 
     @action(
         methods=['post'],
@@ -175,6 +290,9 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer_class=AgreementSerializer
     )
     def review_check(self, request, pk=None):
+        if 'answers' in request.data:
+            return self.review_check_bulk(request, pk)
+
         data = request.data
         data['receiver'] = self.request.user.pk
         serializer = AgreementSerializer(data=data)
@@ -186,21 +304,57 @@ class ProductViewSet(viewsets.ModelViewSet):
             print(e)
             return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+    def review_check_bulk(self, request, pk=None):
+        # all answers for the product in one request, validated and written in a single batch
+        product = get_object_or_404(Product.objects.only('id'), pk=pk)
+        serializer = AgreementBulkSerializer(data=request.data, context={'request': request, 'product': product})
+        try:
+            serializer.is_valid(raise_exception=True)
+            agreements = serializer.save()
+            return Response(AgreementSerializer(agreements, many=True).data, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
 
-class ContractViewSet(viewsets.ModelViewSet):
+class ContractViewSet(SparseFieldsMixin, CachedListMixin, viewsets.ModelViewSet):
     serializer_class = ContractQuestionSerializer
     queryset = ContractQuestion.objects.all()
     http_method_names = ['get', 'post', 'put']
+    replica_reads = True
 
 
-class DisputeViewSet(viewsets.ModelViewSet):
+class DisputeViewSet(ExportMixin, StreamingListMixin, SparseFieldsMixin, SearchMixin, viewsets.ModelViewSet):
     serializer_class = DisputeSerializer
-    queryset = Dispute.objects.all()
+    queryset = Dispute.objects.select_related(
+        'user',
+        'reason',
+        'product__user',
+        'product__receiver',
+    ).prefetch_related(
+        'disputeimage_set',
+        'user__groups',
+        'product__productimage_set',
+        'product__user__groups',
+        'product__receiver__groups',
+    )
     http_method_names = ['get', 'post', 'put']
-    parser_classes = (MultiPartParser, FormParser, JSONParser)
-    filter_backends = [DjangoFilterBackend]
+    parser_classes = (MultiPartParser, FormParser, ORJSONParser)
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
     filterset_fields = ['status']
+    search_fields = ('description',)
+    export_columns = DISPUTE_EXPORT_COLUMNS
+    field_relations = {
+        'user': (['user'], ['user__groups']),
+        'reason': (['reason'], []),
+        'product': (
+            ['product__user', 'product__receiver'],
+            ['product__productimage_set', 'product__user__groups', 'product__receiver__groups'],
+        ),
+        'dispute_photos': ([], ['disputeimage_set']),
+    }
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    replica_reads = True
 
     @action(
         detail=False,
@@ -210,9 +364,11 @@ class DisputeViewSet(viewsets.ModelViewSet):
         serializer_class=DisputeReasonSerializer
     )
     def get_reasons(self, request, pk=None):
-        reasons = DisputeReason.objects.all()
-        serializer = DisputeReasonSerializer(reasons, many=True)
-        return Response(serializer.data)
+        return cached_list_response(
+            request,
+            DisputeReason,
+            lambda: DisputeReasonSerializer(DisputeReason.objects.all(), many=True).data,
+        )
 
     @action(
         detail=False,
@@ -270,13 +426,92 @@ class DisputeViewSet(viewsets.ModelViewSet):
             return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ProtectionFeeViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
+    serializer_class = TransactionSerializer
+    queryset = Transaction.objects.all()
+    http_method_names = ['get', 'post']
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['state']
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_staff:
+            return queryset
+        return queryset.filter(Q(buyer_id=user.pk) | Q(seller_id=user.pk))
+
+    def transition(self, request, action_name):
+        escrow = self.get_object()
+        serializer = TransactionTransitionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        if not can_act(escrow, action_name, request.user):
+            return Response({"success": False, 'error': f'You cannot {action_name} this transaction'},
+                            status=status.HTTP_403_FORBIDDEN)
+        try:
+            apply_transition(escrow, action_name, serializer.validated_data.get('version'))
+        except StaleTransaction as e:
+            return Response({"success": False, 'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except InvalidTransition as e:
+            return Response({"success": False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(TransactionSerializer(escrow).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["POST"], url_path='fund', url_name='fund',
+            serializer_class=TransactionTransitionSerializer)
+    def fund(self, request, pk=None):
+        return self.transition(request, 'fund')
+
+    @action(detail=True, methods=["POST"], url_path='deliver', url_name='deliver',
+            serializer_class=TransactionTransitionSerializer)
+    def deliver(self, request, pk=None):
+        return self.transition(request, 'deliver')
+
+    @action(detail=True, methods=["POST"], url_path='release', url_name='release',
+            serializer_class=TransactionTransitionSerializer)
+    def release(self, request, pk=None):
+        return self.transition(request, 'release')
+
+    @action(detail=True, methods=["POST"], url_path='dispute', url_name='dispute',
+            serializer_class=TransactionTransitionSerializer)
+    def dispute(self, request, pk=None):
+        return self.transition(request, 'dispute')
+
+
+class ProtectionFeeViewSet(SparseFieldsMixin, CachedListMixin, viewsets.ModelViewSet):
     serializer_class = ProtectionFeeSerializer
     queryset = ProtectionFee.objects.all()
     http_method_names = ['get', 'post', 'put']
+    replica_reads = True
+
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path='quote',
+        url_name='quote',
+        serializer_class=FeeQuoteSerializer
+    )
+    def quote(self, request):
+        serializer = FeeQuoteSerializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+            amounts = serializer.validated_data['amounts']
+            quotes = [
+                {'amount': str(amount), 'fee': str(fee), 'total': str(amount + fee)}
+                for amount, fee in zip(amounts, quote_fees(amounts))
+            ]
+            return Response({'quotes': quotes}, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({"success": False, 'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class FAQsViewSet(viewsets.ModelViewSet):
+class FAQsViewSet(SparseFieldsMixin, SearchMixin, CachedListMixin, viewsets.ModelViewSet):
     serializer_class = FAQsSerializer
     queryset = FAQs.objects.all()
-    http_method_names = ['get', 'post', 'put']
\ No newline at end of file
+    http_method_names = ['get', 'post', 'put']
+    replica_reads = True
+    filter_backends = [FullTextSearchFilter]
+    search_fields = ('question', 'answer')
+    search_trigram_field = 'question'
+    paginate_search = False
\ No newline at end of file